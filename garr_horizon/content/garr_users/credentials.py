@@ -0,0 +1,85 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""One-time files of generated credentials.
+
+The passwords generated by a bulk reset are kept in Django's cache, for
+the user who reset them, until the file is downloaded once or the
+GARR_USERS_CREDENTIALS_TTL (300 seconds by default) expires. Resets run
+by the worker store the file from another process: the cache must be
+shared (memcached, Redis, the database), not the local memory one.
+"""
+
+import csv
+import io
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.crypto import get_random_string
+import six
+
+CREDENTIALS_KEY = 'garr_users:credentials:%s:%s'
+
+HEADER = ('id', 'name', 'email', 'password')
+
+# Characters of the generated passwords, without look-alikes
+ALLOWED_CHARS = ('abcdefghjkmnpqrstuvwxyzABCDEFGHJKLMNPQRSTUVWXYZ'
+                 '23456789')
+
+
+def generate_password(length):
+    return get_random_string(length, ALLOWED_CHARS)
+
+
+def get_ttl():
+    return getattr(settings, 'GARR_USERS_CREDENTIALS_TTL', 300)
+
+
+def encode_row(row):
+    """The csv module of Python 2 only writes byte strings."""
+    if six.PY2:
+        return [value.encode('utf-8') if isinstance(value, six.text_type)
+                else value for value in row]
+    return row
+
+
+def store(owner, rows, token=None):
+    """Keep the CSV file of the ``(id, name, email, password)`` ``rows``.
+
+    Returns the token the file is downloaded with, a new one unless
+    ``token`` is given.
+    """
+    output = io.BytesIO() if six.PY2 else io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(HEADER)
+    writer.writerows(encode_row(row) for row in rows)
+    token = token or uuid.uuid4().hex
+    cache.set(CREDENTIALS_KEY % (owner, token), output.getvalue(),
+              get_ttl())
+    return token
+
+
+def pop(owner, token):
+    """Return the credentials file of ``token`` and forget it.
+
+    Returns ``None`` when the file was already downloaded, expired,
+    isn't stored yet or belongs to another user. Only one of concurrent
+    downloads gets the file: it is taken by adding a marker, which the
+    cache adds atomically.
+    """
+    key = CREDENTIALS_KEY % (owner, token)
+    content = cache.get(key)
+    if content is None or not cache.add(key + ':taken', True, get_ttl()):
+        return None
+    cache.delete(key)
+    return content
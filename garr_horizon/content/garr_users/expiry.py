@@ -0,0 +1,117 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Disabling of the Keystone accounts of expired GARR users.
+
+Users expire ``duration`` after their creation, the ``expires`` column
+holds that time. Expired users are selected in batches through the
+``(expired_at, expires)`` index, their Keystone accounts are disabled
+concurrently and the users whose account was disabled are marked expired
+with a single ``UPDATE``. Expired users without an account are left
+unmarked, so an account created for them later is disabled by the next
+run.
+"""
+
+from datetime import datetime
+import logging
+
+from django.db.models import Q
+
+from garr_horizon.content.garr_users import keystone
+from garr_horizon.content.garr_users.models import User
+
+LOG = logging.getLogger(__name__)
+
+
+class SweepReport(object):
+
+    def __init__(self):
+        self.expired = 0
+        self.disabled = 0
+        self.failed = []
+
+
+def get_keystone_ids(keystone_api):
+    """Keystone user ids of the default domain, by user name."""
+    domain = keystone_api.default_domain()
+    return dict((user.name, user.id)
+                for user in keystone_api.users(domain.id))
+
+
+def sweep(keystone_api, batch_size=500, concurrency=None, now=None):
+    """Disable the Keystone accounts of the users expired at ``now``.
+
+    Users without a Keystone account are skipped, and users whose account
+    couldn't be disabled are left for the next run. Returns a
+    ``SweepReport``.
+    """
+    now = now or datetime.now()
+    report = SweepReport()
+    keystone_ids = get_keystone_ids(keystone_api)
+
+    def disable(user):
+        user_id, name, expires = user
+        try:
+            keystone_api.disable_user(keystone_ids[name])
+        except Exception as e:
+            LOG.info('Unable to disable Keystone user "%s": %s', name, e)
+            return user, str(e) or e.__class__.__name__
+        return user, None
+
+    expired = User.objects.expired(now).order_by('expires', 'id')
+    batch = []
+    while True:
+        # Users left unmarked are skipped by paging on (expires, id)
+        users = expired
+        if batch:
+            last_id, name, last_expires = batch[-1]
+            users = users.filter(Q(expires__gt=last_expires) |
+                                 Q(expires=last_expires, id__gt=last_id))
+        batch = list(users.values_list('id', 'name',
+                                       'expires')[:batch_size])
+        if not batch:
+            return report
+        accounts = [user for user in batch if user[1] in keystone_ids]
+        done = []
+        for user, error in keystone.run_concurrently(disable, accounts,
+                                                     concurrency):
+            if error is None:
+                done.append(user[0])
+                report.disabled += 1
+            else:
+                report.failed.append((user[1], error))
+        if done:
+            # Bumping updated refreshes the pages and rows showing them
+            report.expired += User.objects.filter(id__in=done) \
+                .update(expired_at=now, updated=now)
+
+
+def reactivate(keystone_api, names, concurrency=None):
+    """Enable again the Keystone accounts of the GARR users ``names``.
+
+    Used for users no longer expired, whose account the sweep disabled.
+    Returns the names of the users whose account couldn't be enabled.
+    """
+    keystone_ids = get_keystone_ids(keystone_api)
+
+    def enable(name):
+        try:
+            keystone_api.enable_user(keystone_ids[name])
+        except Exception as e:
+            LOG.info('Unable to enable Keystone user "%s": %s', name, e)
+            return name, e
+        return name, None
+
+    names = [name for name in names if name in keystone_ids]
+    return [name for name, error
+            in keystone.run_concurrently(enable, names, concurrency)
+            if error is not None]
@@ -16,12 +16,17 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import codecs
 import collections
 import logging
 
 from django.conf import settings
+from django.core.urlresolvers import reverse
 from django.forms import ValidationError
+from django.forms.utils import flatatt
 from django import http
+from django.utils.dateparse import parse_datetime
+from django.utils.html import format_html
 from django.utils.translation import ugettext_lazy as _
 from django.views.decorators.debug import sensitive_variables
 
@@ -34,35 +39,80 @@ from horizon.utils import validators
 from openstack_dashboard import api
 from openstack_dashboard.dashboards.identity.users.forms \
     import AddExtraColumnMixIn, PasswordMixin
-from garr_horizon.content.garr_users.models import User, Project
+from garr_horizon.content.garr_users import expiry
+from garr_horizon.content.garr_users import hashing
+from garr_horizon.content.garr_users import importer
+from garr_horizon.content.garr_users import jobs
+from garr_horizon.content.garr_users import keystone
+from garr_horizon.content.garr_users.models import Project
+from garr_horizon.content.garr_users.models import UpdateConflict
+from garr_horizon.content.garr_users.models import User
 from openstack_dashboard.local.local_settings import KEYSTONE_USER_PASS
 
 LOG = logging.getLogger(__name__)
 PROJECT_REQUIRED = api.keystone.VERSIONS.active < 3
 
-class BaseUserForm(forms.SelfHandlingForm):
-    def __init__(self, request, *args, **kwargs):
-        super(BaseUserForm, self).__init__(request, *args, **kwargs)
-
-        # Populate project choices
-        user_id = kwargs['initial'].get('id', None)
-        default_project_id = kwargs['initial'].get('project', None)
-        if default_project_id: default_project_id = default_project_id.id
-        project_choices = [(project.id, project.name) for project in Project.objects.all()]
-        if not project_choices:
-            project_choices.insert(0, ('', _("No available projects")))
-        else:
-            project_choices.append(('', _('No default project')))
-        if default_project_id is None:
-            project_choices.insert(0, ('', _('Select a project')))
-        self.fields['project'].choices = project_choices
-
-
-
-class CreateUserForm(PasswordMixin, BaseUserForm):
+class ProjectTypeahead(forms.TextInput):
+    """Text input completing GARR project names as the user types.
+
+    The names are looked up through the panel's ``projects`` JSON view,
+    while the id of the chosen project is what gets submitted, through a
+    hidden input.
+    """
+
+    def render(self, name, value, attrs=None, renderer=None):
+        attrs = dict(self.attrs, **(attrs or {}))
+        field_id = attrs.pop('id', 'id_%s' % name)
+        value_id = '%s_value' % field_id
+        list_id = '%s_list' % field_id
+
+        label = value
+        if value not in (None, ''):
+            try:
+                label = dict(Project.objects.choices()).get(int(value), value)
+            except (TypeError, ValueError):
+                pass
+
+        attrs.update({
+            'id': field_id,
+            'type': 'text',
+            'value': label or '',
+            'list': list_id,
+            'autocomplete': 'off',
+            'data-url': reverse('horizon:identity:garr_users:projects'),
+            'data-target': value_id,
+        })
+        attrs['class'] = ' '.join(
+            filter(None, (attrs.get('class'), 'garr-project-typeahead')))
+        hidden = forms.HiddenInput().render(name, value, {'id': value_id})
+        return format_html('{0}<input{1} /><datalist id="{2}"></datalist>',
+                           hidden, flatatt(attrs), list_id)
+
+
+class ProjectField(forms.CharField):
+    """GARR project picked with a typeahead, cleaned to the project id."""
+    widget = ProjectTypeahead
+
+    def clean(self, value):
+        value = super(ProjectField, self).clean(value)
+        if not value:
+            return ''
+        try:
+            project_id = int(value)
+        except ValueError:
+            raise ValidationError(_('Select a valid project.'))
+        # Check the cached projects first, the table only has to be
+        # queried for projects created since they were cached.
+        if project_id not in dict(Project.objects.choices()) and \
+                not Project.objects.filter(id=project_id).exists():
+            raise ValidationError(_('Select a valid project.'))
+        return project_id
+
+
+class CreateUserForm(PasswordMixin, forms.SelfHandlingForm):
     name = forms.CharField(max_length=100, label=_("User Name"))
     email = forms.EmailField(max_length=40, label=_("Email"))
-    project = forms.ThemableDynamicChoiceField(label=_("Project"), required=False)
+    project = ProjectField(label=_("Project"), required=False)
     idp = forms.CharField(max_length=30, label=_("Identity Provider"))
     cn = forms.CharField(max_length=255, label=_("Common Name"), required=False)
     duration = forms.IntegerField(label=_("Duration"), required=False)
@@ -92,11 +142,45 @@ class CreateUserForm(PasswordMixin, BaseUserForm):
             messages.error(request , _('Unable to create user.'))
             return exceptions.handle(request, ignore=True)
 
-class UpdateUserForm(BaseUserForm):
+def get_renewed(users, values):
+    """Names of the expired ``users`` the duration of ``values`` renews.
+
+    Editing the duration unmarks them (see ``User.objects.bulk_edit``),
+    their Keystone accounts, disabled by the expiry sweep, are left to
+    ``reactivate``.
+    """
+    if 'duration' not in values:
+        return []
+    return list(users.renewed(values['duration'])
+                .values_list('name', flat=True))
+
+
+def reactivate(request, names):
+    """Enable again the Keystone accounts of the renewed users ``names``."""
+    if not names:
+        return
+    try:
+        failed = expiry.reactivate(keystone.RequestKeystone(request), names)
+        keystone.invalidate(request, 'users')
+    except Exception:
+        failed = names
+    if failed:
+        messages.warning(request, _(
+            'Unable to enable the Keystone accounts of the users no '
+            'longer expired: "%s".') % '", "'.join(failed))
+    else:
+        messages.info(request, _('%d users are no longer expired, their '
+                                 'Keystone accounts were enabled.')
+                      % len(names))
+
+
+class UpdateUserForm(forms.SelfHandlingForm):
     id = forms.CharField(label=_("ID"), widget=forms.HiddenInput)
+    # Last update of the user when the form was opened
+    version = forms.CharField(widget=forms.HiddenInput)
     name = forms.CharField(max_length=100, label=_("User Name"))
     email = forms.EmailField(max_length=40, label=_("Email"))
-    project = forms.ThemableChoiceField(label=_(" Project"), required=False)
+    project = ProjectField(label=_("Project"), required=False)
     idp = forms.CharField(max_length=30, label=_("Identity Provider"))
     cn = forms.CharField(max_length=255, label=_("Common Name"),required=False)
     source = forms.CharField(max_length=255, label=_("Source"), required=False)
@@ -108,17 +192,237 @@ class UpdateUserForm(BaseUserForm):
             for field in ('name', 'email'):
                 self.fields.pop(field)
 
+    def clean_version(self):
+        version = parse_datetime(self.cleaned_data['version'])
+        if version is None:
+            raise ValidationError(_('Invalid user version.'))
+        return version
+
     def handle(self, request, data):
         try:
-            User.update_user(data)
+            renewed = []
+            if 'duration' in self.changed_data:
+                renewed = get_renewed(User.objects.filter(id=int(data['id'])),
+                                      data)
+            User.update_user(data, self.changed_data, data['version'])
             messages.success(request,
                              _('User has been updated successfully.'))
+            reactivate(request, renewed)
             return True
+        except UpdateConflict:
+            self.api_error(_('The user was changed by someone else since '
+                             'this form was opened, reload it and try '
+                             'again.'))
+            return False
         except Exception:
             messages.error(request, _('Unable to update the user.'))
             return exceptions.handle(request, ignore=True)
 
-class ActivateUserForm(PasswordMixin, BaseUserForm, AddExtraColumnMixIn):
+class UserSelectionForm(forms.SelfHandlingForm):
+    """Base of the forms acting on many users at once.
+
+    The users are either the ``ids`` selected in the table or all the
+    users matching the table filter the form was opened with. Without a
+    selection or a filter, the form refuses to act rather than acting on
+    every user.
+    """
+    ids = forms.CharField(widget=forms.HiddenInput, required=False)
+    filter_field = forms.CharField(widget=forms.HiddenInput, required=False)
+    filter_string = forms.CharField(widget=forms.HiddenInput, required=False)
+
+    def clean_ids(self):
+        ids = self.cleaned_data['ids']
+        try:
+            return [int(user_id) for user_id in ids.split(',') if user_id]
+        except ValueError:
+            raise ValidationError(_('Invalid user selection.'))
+
+    def clean(self):
+        data = super(UserSelectionForm, self).clean()
+        if not data.get('ids') and not data.get('filter_string'):
+            raise ValidationError(_('Select users or filter the table '
+                                    'first.'))
+        return data
+
+    @staticmethod
+    def get_users(data):
+        if data.get('ids'):
+            return User.objects.filter(id__in=data['ids'])
+        if data.get('filter_string'):
+            return User.objects.filter_by(data['filter_field'],
+                                          data['filter_string'])
+        raise ValueError('Neither users nor a filter were selected.')
+
+
+class BulkUpdateUserForm(UserSelectionForm):
+    """Apply the same project, duration or source to many users at once.
+
+    Fields left empty are not changed.
+    """
+    project = ProjectField(label=_("Project"), required=False)
+    duration = forms.IntegerField(label=_("Duration"), required=False)
+    source = forms.CharField(max_length=255, label=_("Source"),
+                             required=False)
+
+    EDITABLE_FIELDS = ('project', 'duration', 'source')
+
+    def clean(self):
+        cleaned_data = super(BulkUpdateUserForm, self).clean()
+        if all(cleaned_data.get(field) in (None, '')
+               for field in self.EDITABLE_FIELDS):
+            raise ValidationError(_('Fill in at least one field to update.'))
+        return cleaned_data
+
+    def handle(self, request, data):
+        values = dict((field, data[field]) for field in self.EDITABLE_FIELDS
+                      if data[field] not in (None, ''))
+        if 'project' in values:
+            values['project_id'] = values.pop('project')
+        try:
+            users = self.get_users(data)
+            renewed = get_renewed(users, values)
+            count = users.bulk_edit(**values)
+            messages.success(request,
+                             _('%d users have been updated successfully.')
+                             % count)
+        except Exception:
+            messages.error(request, _('Unable to update the users.'))
+            return exceptions.handle(request, ignore=True)
+        reactivate(request, renewed)
+        return True
+
+
+class ResetPasswordsForm(UserSelectionForm):
+    """Reset the passwords of many users at once.
+
+    Either a random password is generated for each user, by a job of the
+    background worker, and the generated credentials can be downloaded
+    once, or the same password is hashed once and set on all of them with
+    a single ``UPDATE`` statement.
+    """
+    GENERATE = 'generate'
+    SET = 'set'
+
+    mode = forms.ThemableChoiceField(
+        label=_("Passwords"),
+        choices=((GENERATE, _("Generate a password for each user")),
+                 (SET, _("Set the same password on all users"))),
+        widget=forms.ThemableSelectWidget(attrs={
+            'class': 'switchable',
+            'data-slug': 'mode'}))
+    length = forms.IntegerField(
+        label=_("Length"), initial=16, min_value=12, max_value=64,
+        widget=forms.NumberInput(attrs={
+            'class': 'switched',
+            'data-switch-on': 'mode',
+            'data-mode-generate': _("Length")}))
+    password = forms.RegexField(
+        label=_("Password"),
+        required=False,
+        widget=forms.PasswordInput(render_value=False, attrs={
+            'class': 'switched',
+            'data-switch-on': 'mode',
+            'data-mode-set': _("Password")}),
+        regex=validators.password_validator(),
+        error_messages={'invalid': validators.password_validator_msg()})
+    confirm_password = forms.CharField(
+        label=_("Confirm Password"),
+        required=False,
+        widget=forms.PasswordInput(render_value=False, attrs={
+            'class': 'switched',
+            'data-switch-on': 'mode',
+            'data-mode-set': _("Confirm Password")}))
+
+    def clean(self):
+        data = super(ResetPasswordsForm, self).clean()
+        if data.get('mode') == self.SET:
+            if not data.get('password'):
+                raise ValidationError(_('Enter the new password.'))
+            if data['password'] != data.get('confirm_password'):
+                raise ValidationError(_('Passwords do not match.'))
+        return data
+
+    @sensitive_variables('data')
+    def handle(self, request, data):
+        try:
+            if data['mode'] == self.GENERATE:
+                job = jobs.enqueue_password_reset(
+                    request.user.username,
+                    self.get_users(data).order_by('id')
+                    .values_list('id', flat=True),
+                    data['length'])
+            else:
+                count = self.get_users(data).set_password(
+                    hashing.hash_password(data['password']))
+                LOG.info('Reset the passwords of %d GARR users', count)
+        except Exception:
+            messages.error(request, _('Unable to reset the passwords.'))
+            return exceptions.handle(request, ignore=True)
+
+        if data['mode'] == self.GENERATE:
+            url = reverse('horizon:identity:garr_users:credentials',
+                          args=(job.token,))
+            messages.success(request, format_html(
+                _('The passwords of {0} users are being reset in '
+                  'background. <a href="{1}">Download the new '
+                  'credentials</a> once done, the file can only be '
+                  'downloaded once.'), job.count, url))
+        else:
+            messages.success(request,
+                             _('The passwords of %d users have been reset.')
+                             % count)
+        return True
+
+
+class ImportUsersForm(forms.SelfHandlingForm):
+    import_file = forms.FileField(label=_("File"))
+    file_format = forms.ThemableChoiceField(
+        label=_("Format"),
+        choices=(('csv', _('CSV')), ('json', _('JSON'))))
+
+    # Number of row errors shown after an import
+    shown_errors = 10
+
+    @staticmethod
+    def open_file(data):
+        data['import_file'].seek(0)
+        return codecs.getreader('utf-8-sig')(data['import_file'])
+
+    def handle(self, request, data):
+        # Passwords are hashed during the request, larger files are left
+        # to the garr_users_import command.
+        max_rows = getattr(settings, 'GARR_USERS_IMPORT_MAX_ROWS', 100)
+        try:
+            if max_rows is not None:
+                rows = importer.count_rows(self.open_file(data),
+                                           data['file_format'])
+                if rows > max_rows:
+                    self.api_error(_(
+                        'The file holds %(rows)d users, up to %(max)d can be '
+                        'imported from the panel. Import it with the '
+                        'garr_users_import command instead.')
+                        % {'rows': rows, 'max': max_rows})
+                    return False
+            report = importer.import_users(self.open_file(data),
+                                           data['file_format'])
+        except Exception:
+            messages.error(request, _('Unable to import users.'))
+            return exceptions.handle(request, ignore=True)
+
+        if report.created:
+            messages.success(request, _('Imported %d users.')
+                             % report.created)
+        if report.errors:
+            messages.error(request, _('%d rows could not be imported.')
+                           % report.failed)
+            for line, error in report.errors[:self.shown_errors]:
+                messages.warning(request, _('Row %(line)s: %(error)s')
+                                 % {'line': line, 'error': error})
+        return True
+
+
+class ActivateUserForm(PasswordMixin, forms.SelfHandlingForm,
+                       AddExtraColumnMixIn):
     # Hide the domain_id and domain_name by default
     domain_id = forms.CharField(label=_("Domain ID"),
                                 required=False,
@@ -144,12 +448,20 @@ class ActivateUserForm(PasswordMixin, BaseUserForm, AddExtraColumnMixIn):
 
     default_user_id = forms.IntegerField(label=_('User ID'),
                                         widget=forms.HiddenInput())
+    background = forms.BooleanField(
+        label=_("Create in background"),
+        help_text=_("Queue the creation of the user for the background "
+                    "worker, see Keystone Jobs. The user gets the default "
+                    "password."),
+        required=False)
 
     @staticmethod
-    def get_os_projects(request, project_name, domain_id):
+    def get_os_projects(request, project_name, domain_id,
+                        keystone_projects=None):
         # Populate project choices
         project_choices = []
-        keystone_projects, has_more = api.keystone.tenant_list(request)
+        if keystone_projects is None:
+            keystone_projects, has_more = keystone.tenant_list(request)
         matching_project = None
 
         # Check if asigned project matches
@@ -163,7 +475,7 @@ class ActivateUserForm(PasswordMixin, BaseUserForm, AddExtraColumnMixIn):
                     project_choices.append((project.id, project.name))
 
         if matching_project:
-            project_choices.append(0, matching_project)
+            project_choices.insert(0, matching_project)
         elif not project_choices:
             project_choices.insert(0, ('', _('No available projects')))
         else:
@@ -172,15 +484,17 @@ class ActivateUserForm(PasswordMixin, BaseUserForm, AddExtraColumnMixIn):
 
     def __init__(self, *args, **kwargs):
         roles = kwargs.pop('roles')
+        projects = kwargs.pop('projects', None)
         super(ActivateUserForm, self).__init__(*args, **kwargs)
         project_name = kwargs['initial'].get('project', None)
         domain_id = kwargs['initial'].get('domain_id', None)
-        self.fields['project'].choices = self.get_os_projects(args[0], project_name, domain_id)
+        self.fields['project'].choices = self.get_os_projects(
+            args[0], project_name, domain_id, projects)
         # Reorder form fields from multiple inheritance
         ordering = ["default_user_id", "domain_id", "domain_name", "name",
                     "description", "email", "password",
                     "confirm_password", "project", "role_id",
-                    "enabled"]
+                    "enabled", "background"]
         self.add_extra_fields(ordering)
         self.fields = collections.OrderedDict(
             (key, self.fields[key]) for key in ordering)
@@ -201,11 +515,28 @@ class ActivateUserForm(PasswordMixin, BaseUserForm, AddExtraColumnMixIn):
         self.fields['password'].required = False
         self.fields['confirm_password'].required = False
 
+    def clean(self):
+        data = super(ActivateUserForm, self).clean()
+        # Passwords are not stored with the queued jobs
+        if data.get('background') and data.get('password'):
+            raise ValidationError(_('Users created in background get the '
+                                    'default password, leave the password '
+                                    'empty.'))
+        return data
+
     # We have to protect the entire "data" dict because it contains the
     # password and confirm_password strings.
     @sensitive_variables('data')
     def handle(self, request, data):
         user_id = data.get('default_user_id', None)
+        if data.get('background'):
+            job = jobs.enqueue_activation(request.user.username, data)
+            messages.success(request,
+                             _('The creation of user "%(name)s" was queued '
+                               'as job %(job)s.')
+                             % {'name': data['name'], 'job': job.id})
+            return True
+
         if not data['password']:
             data['password'] = KEYSTONE_USER_PASS
 
@@ -216,41 +547,19 @@ class ActivateUserForm(PasswordMixin, BaseUserForm, AddExtraColumnMixIn):
         domain = api.keystone.get_default_domain(request, False)
         try:
             LOG.info('Creating user with name "%s"', data['name'])
-            # add extra information
-            if api.keystone.VERSIONS.active >= 3:
-                EXTRA_INFO = getattr(settings, 'USER_TABLE_EXTRA_INFO', {})
-                kwargs = dict((key, data.get(key)) for key in EXTRA_INFO)
-            else:
-                kwargs = {}
-            new_user = \
-                api.keystone.user_create(request,
-                                         name=data['name'],
-                                         email=data['email'],
-                                         description=data['description'] or None,
-                                         password=data['password'],
-                                         project=data['project'] or None,
-                                         enabled=data['enabled'],
-                                         domain=domain.id,
-                                         **kwargs)
+            new_user = keystone.create_user(request, data, domain.id)
+            keystone.invalidate(request, 'users')
             messages.success(request,
                              _('User "%s" was successfully created.')
                              % data['name'])
             if data['project'] and data['role_id']:
-                roles = api.keystone.roles_for_user(request,
-                                                    new_user.id,
-                                                    data['project']) or []
-                assigned = [role for role in roles if role.id == str(
-                    data['role_id'])]
-                if not assigned:
-                    try:
-                        api.keystone.add_tenant_user_role(request,
-                                                          data['project'],
-                                                          new_user.id,
-                                                          data['role_id'])
-                    except Exception:
-                        exceptions.handle(request,
-                                          _('Unable to add user '
-                                            'to primary project.'))
+                try:
+                    keystone.grant_role(request, new_user.id,
+                                        data['project'], data['role_id'])
+                except Exception:
+                    exceptions.handle(request,
+                                      _('Unable to add user '
+                                        'to primary project.'))
             return new_user
         except exceptions.Conflict:
             msg = _('User name "%s" is already used.') % data['name']
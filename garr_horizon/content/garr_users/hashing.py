@@ -0,0 +1,126 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Password hashing on a pool of processes.
+
+Hashing with PBKDF2 at production iteration counts takes hundreds of
+milliseconds of CPU. The management commands hashing many passwords (the
+import and the background worker) hash them in parallel on a pool of
+processes. Horizon's web processes hash in the calling thread unless
+GARR_USERS_HASHING_PROCESSES says otherwise: they run several of them,
+each with many threads, which a pool per process wouldn't bound, and
+forking a threaded process is unsafe.
+"""
+
+import atexit
+import logging
+import multiprocessing
+import threading
+
+from django.conf import settings
+from django.contrib.auth.hashers import get_hasher
+from django.contrib.auth.hashers import make_password
+from openstack_dashboard.local.local_settings import HASHING_ALGORITHM
+
+LOG = logging.getLogger(__name__)
+
+# Algorithms the HASHING_ALGORITHM setting can name
+ALGORITHMS = ('pbkdf2_sha256', 'pbkdf2_sha1', 'sha1', 'md5')
+
+
+def encode(args):
+    """Hash ``(password, algorithm, iterations)``, in a pool process.
+
+    ``iterations`` is only used by the hashers having an iteration count,
+    ``None`` keeps the hasher's own. Like ``make_password``, a ``None``
+    password gives an unusable password.
+    """
+    password, algorithm, iterations = args
+    if password is None:
+        return make_password(None)
+    hasher = get_hasher(algorithm)
+    if iterations is not None and hasattr(hasher, 'iterations'):
+        return hasher.encode(password, hasher.salt(), iterations)
+    return hasher.encode(password, hasher.salt())
+
+
+class HashingService(object):
+    """Hash passwords on a pool of ``processes`` processes.
+
+    The pool is started on first use. With no processes, passwords are
+    hashed in the calling thread. Waiting for hashes gives up after
+    ``timeout`` seconds per hash and process.
+    """
+
+    def __init__(self, processes=None, timeout=60):
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.processes = processes
+        self.timeout = timeout
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                LOG.debug('Starting %d password hashing processes',
+                          self.processes)
+                self._pool = multiprocessing.Pool(self.processes)
+            return self._pool
+
+    def hash(self, password, algorithm=None, iterations=None):
+        return self.hash_many([password], algorithm, iterations)[0]
+
+    def hash_many(self, passwords, algorithm=None, iterations=None):
+        """Hash ``passwords``, returning the hashes in the same order."""
+        algorithm = algorithm or HASHING_ALGORITHM
+        tasks = [(password, algorithm, iterations) for password in passwords]
+        if not self.processes or not tasks:
+            return [encode(task) for task in tasks]
+        # The timeout is per hash, for each process of the pool
+        timeout = self.timeout * (1 + len(tasks) // self.processes)
+        return self.get_pool().map_async(encode, tasks).get(timeout)
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_service():
+    """The service shared by the process, sized by the settings.
+
+    GARR_USERS_HASHING_PROCESSES sets the number of processes, by default
+    0, which hashes passwords in the calling thread.
+    """
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = HashingService(
+                getattr(settings, 'GARR_USERS_HASHING_PROCESSES', 0),
+                getattr(settings, 'GARR_USERS_HASHING_TIMEOUT', 60))
+            atexit.register(_service.close)
+        return _service
+
+
+def hash_password(password):
+    return get_service().hash(password)
+
+
+def hash_passwords(passwords):
+    return get_service().hash_many(passwords)
@@ -0,0 +1,306 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Bulk import of GARR users from CSV or JSON files.
+
+Files are parsed as a stream, so their size doesn't matter. Valid rows
+are gathered in chunks: the passwords of a chunk are hashed in parallel
+by the hashing service, then the chunk is inserted with ``bulk_create``
+in its own transaction. Invalid rows, rows that can't be parsed and users whose
+name is already taken are skipped and reported, along with their line (CSV) or
+item (JSON) number.
+"""
+
+import csv
+from datetime import datetime
+import json
+import logging
+import re
+
+from django import forms
+from django.db import transaction
+import six
+
+from garr_horizon.content.garr_users import hashing
+from garr_horizon.content.garr_users.models import get_expiry
+from garr_horizon.content.garr_users.models import Project
+from garr_horizon.content.garr_users.models import User
+
+LOG = logging.getLogger(__name__)
+
+FORMATS = ('csv', 'json')
+
+# Largest JSON item, in characters, before it is reported as malformed
+MAX_ITEM_SIZE = 1024 * 1024
+
+# Where JSON decoding resumes after a malformed item: the next line
+# starting an object.
+NEXT_OBJECT = re.compile(r'\n\s*\{')
+
+
+class ParseError(ValueError):
+    """A row of the file that couldn't be parsed, yielded by the readers."""
+
+
+class ImportRowForm(forms.Form):
+    name = forms.CharField(max_length=100)
+    email = forms.EmailField(max_length=40)
+    password = forms.CharField(max_length=128)
+    idp = forms.CharField(max_length=30)
+    project = forms.CharField(max_length=255, required=False)
+    cn = forms.CharField(max_length=255, required=False)
+    source = forms.CharField(max_length=255, required=False)
+    duration = forms.IntegerField(required=False)
+
+    def __init__(self, data, project_ids):
+        super(ImportRowForm, self).__init__(data)
+        self.project_ids = project_ids
+
+    def clean_project(self):
+        name = self.cleaned_data['project']
+        if not name:
+            return None
+        if name not in self.project_ids:
+            raise forms.ValidationError('Unknown project "%s".' % name)
+        return self.project_ids[name]
+
+
+def _decode(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    return value
+
+
+def read_csv(stream):
+    """Yield the ``(line, row)`` of a CSV text stream with a header row.
+
+    Lines that can't be parsed are yielded as a ``ParseError`` and
+    reading goes on with the next line.
+    """
+    if six.PY2:
+        # The Python 2 csv module only reads bytes
+        reader = csv.DictReader(line.encode('utf-8') for line in stream)
+    else:
+        reader = csv.DictReader(stream)
+    # DictReader only counts the lines of the rows it returns, errors are
+    # located with the line count of the underlying reader.
+    try:
+        reader.fieldnames
+    except csv.Error as e:
+        yield reader.reader.line_num, ParseError('Invalid header: %s' % e)
+        return
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            yield reader.reader.line_num, ParseError(str(e))
+            continue
+        if six.PY2:
+            row = dict((_decode(key), _decode(value))
+                       for key, value in row.items())
+        yield reader.line_num, row
+
+
+def read_json(stream, chunk_size=64 * 1024, max_item_size=MAX_ITEM_SIZE):
+    """Yield the ``(item, row)`` of a JSON array, or of JSON lines.
+
+    The file is decoded ``chunk_size`` characters at a time instead of
+    being loaded at once. An item that can't be decoded, or that is
+    longer than ``max_item_size``, is yielded as a ``ParseError``, and
+    decoding resumes at the next line starting an object.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    item = 0
+    opened = False
+    skipping = False
+    while True:
+        chunk = stream.read(chunk_size)
+        buffer += chunk
+        while True:
+            if skipping:
+                match = NEXT_OBJECT.search(buffer)
+                if match is None:
+                    # Only keep what may be the start of the next object
+                    tail = buffer[buffer.rfind('\n'):]
+                    buffer = tail if '\n' in buffer and not tail.strip() \
+                        else ''
+                    break
+                buffer = buffer[match.start():]
+                skipping = False
+            buffer = buffer.lstrip()
+            if not opened and buffer.startswith('['):
+                opened = True
+                buffer = buffer[1:]
+                continue
+            if buffer.startswith(','):
+                buffer = buffer[1:]
+                continue
+            if not buffer or buffer.startswith(']'):
+                break
+            try:
+                row, end = decoder.raw_decode(buffer)
+            except ValueError as e:
+                if chunk and len(buffer) < max_item_size:
+                    # The item continues in the next chunk
+                    break
+                item += 1
+                yield item, ParseError(str(e))
+                skipping = True
+                continue
+            item += 1
+            buffer = buffer[end:]
+            yield item, row
+        if not chunk or buffer.startswith(']'):
+            return
+
+
+class ImportReport(object):
+
+    def __init__(self):
+        self.created = 0
+        self.errors = []
+
+    @property
+    def failed(self):
+        return len(self.errors)
+
+    def add_error(self, line, message):
+        self.errors.append((line, message))
+
+
+def import_users(stream, file_format='csv', chunk_size=1000, processes=None):
+    """Import the users of a CSV or JSON text ``stream``.
+
+    CSV files need a header row naming their columns, JSON files hold an
+    array of objects or one object per line. Rows have the ``name``,
+    ``email``, ``password``, ``idp``, ``project`` (name), ``cn``,
+    ``source`` and ``duration`` fields. Users are identified by their
+    name: rows repeating the name of an earlier row or of an existing
+    user are reported rather than imported. Passwords are hashed by a
+    pool of ``processes`` processes, by default the shared hashing
+    service. Returns an ``ImportReport``.
+    """
+    if file_format not in FORMATS:
+        raise ValueError('Unsupported format "%s".' % file_format)
+    rows = read_csv(stream) if file_format == 'csv' else read_json(stream)
+    project_ids = dict((name, project_id) for project_id, name
+                       in Project.objects.choices())
+    report = ImportReport()
+    if processes is None:
+        service = hashing.get_service()
+    else:
+        service = hashing.HashingService(processes)
+    # Line of each name met so far
+    names = {}
+    try:
+        chunk = []
+        for line, row in rows:
+            if isinstance(row, ParseError):
+                report.add_error(line, 'Unable to parse the row: %s' % row)
+                continue
+            if not isinstance(row, dict):
+                report.add_error(line, 'Not an object.')
+                continue
+            form = ImportRowForm(row, project_ids)
+            if not form.is_valid():
+                report.add_error(line, '; '.join(
+                    '%s: %s' % (field, ' '.join(errors))
+                    for field, errors in form.errors.items()))
+                continue
+            name = form.cleaned_data['name']
+            if name in names:
+                report.add_error(line, 'Duplicate of the user of line %s.'
+                                 % names[name])
+                continue
+            names[name] = line
+            chunk.append((line, form.cleaned_data))
+            if len(chunk) >= chunk_size:
+                insert_chunk(chunk, service, report)
+                chunk = []
+        if chunk:
+            insert_chunk(chunk, service, report)
+    except ValueError as e:
+        report.add_error(None, 'Unable to parse the file: %s' % e)
+    finally:
+        if service is not hashing.get_service():
+            service.close()
+    return report
+
+
+def count_rows(stream, file_format='csv'):
+    """Number of rows of a CSV or JSON text ``stream``.
+
+    Rows are only parsed, neither validated nor hashed. Rows that can't be
+    parsed are counted, and counting stops at a file that can't be parsed.
+    """
+    if file_format not in FORMATS:
+        raise ValueError('Unsupported format "%s".' % file_format)
+    rows = read_csv(stream) if file_format == 'csv' else read_json(stream)
+    count = 0
+    try:
+        for row in rows:
+            count += 1
+    except ValueError:
+        pass
+    return count
+
+
+def get_existing_names(names, batch_size=500):
+    """The ``names`` already taken by users, looked up in batches."""
+    names = list(names)
+    existing = set()
+    for start in range(0, len(names), batch_size):
+        existing.update(User.objects
+                        .filter(name__in=names[start:start + batch_size])
+                        .values_list('name', flat=True))
+    return existing
+
+
+def insert_chunk(chunk, service, report):
+    existing = get_existing_names(data['name'] for line, data in chunk)
+    for line, data in chunk:
+        if data['name'] in existing:
+            report.add_error(line, 'User "%s" already exists.'
+                             % data['name'])
+    chunk = [(line, data) for line, data in chunk
+             if data['name'] not in existing]
+    if not chunk:
+        return
+    passwords = service.hash_many([data['password']
+                                   for line, data in chunk])
+    now = datetime.now()
+    users = [User(name=data['name'],
+                  email=data['email'],
+                  password=password,
+                  idp=data['idp'],
+                  cn=data['cn'] or None,
+                  source=data['source'] or None,
+                  project_id=data['project'],
+                  duration=data['duration'],
+                  created=now,
+                  updated=now,
+                  expires=get_expiry(now, data['duration']))
+             for (line, data), password in zip(chunk, passwords)]
+    try:
+        with transaction.atomic():
+            User.objects.bulk_create(users)
+    except Exception as e:
+        LOG.warning('Unable to import users: %s', e)
+        for line, data in chunk:
+            report.add_error(line, 'Unable to insert the user: %s' % e)
+        return
+    report.created += len(users)
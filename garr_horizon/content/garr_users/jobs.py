@@ -0,0 +1,338 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Background creation of Keystone users and password resets.
+
+Jobs and their tasks are stored in the database and processed by the
+``garr_users_worker`` management command, so creating thousands of
+Keystone users, or hashing thousands of passwords, doesn't have to fit in
+an HTTP request. Tasks are claimed
+with a conditional ``UPDATE``, which lets several workers share the
+queue, and a task claimed by a worker that died is claimed again once
+its lease expires. Provisioning reuses Keystone accounts that already
+exist, so running a task twice is harmless.
+"""
+
+import datetime
+import json
+import logging
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.db.models import F
+
+from garr_horizon.content.garr_users import credentials
+from garr_horizon.content.garr_users import keystone
+from garr_horizon.content.garr_users.models import PasswordResetJob
+from garr_horizon.content.garr_users.models import ProvisioningJob
+from garr_horizon.content.garr_users.models import ProvisioningTask
+from garr_horizon.content.garr_users.models import User
+
+LOG = logging.getLogger(__name__)
+
+# Fields of the activation form kept with custom activation tasks
+TASK_DATA_FIELDS = ('name', 'email', 'description', 'project', 'role_id',
+                    'enabled')
+
+
+def enqueue_users(owner, user_ids):
+    """Queue the creation of the Keystone accounts of GARR ``user_ids``."""
+    with transaction.atomic():
+        job = ProvisioningJob.objects.create(owner=owner)
+        ProvisioningTask.objects.bulk_create(
+            [ProvisioningTask(job=job, user_id=user_id)
+             for user_id in user_ids],
+            batch_size=500)
+    return job
+
+
+def enqueue_activation(owner, data):
+    """Queue the creation of a Keystone account out of activation ``data``.
+
+    The password of ``data`` is not stored, the account gets the default
+    one.
+    """
+    task_data = dict((key, data.get(key)) for key in TASK_DATA_FIELDS)
+    with transaction.atomic():
+        job = ProvisioningJob.objects.create(owner=owner)
+        ProvisioningTask.objects.create(job=job,
+                                        user_id=data.get('default_user_id'),
+                                        data=json.dumps(task_data))
+    return job
+
+
+def enqueue_password_reset(owner, user_ids, length):
+    """Queue the reset of the passwords of ``user_ids`` to generated ones.
+
+    The credentials file is stored under the token of the returned job.
+    """
+    user_ids = list(user_ids)
+    return PasswordResetJob.objects.create(
+        owner=owner, token=uuid.uuid4().hex, length=length,
+        user_ids=','.join(str(user_id) for user_id in user_ids),
+        count=len(user_ids))
+
+
+class Worker(object):
+    """Process queued provisioning tasks, ``batch_size`` at a time.
+
+    The tasks of a batch are run concurrently by ``concurrency`` threads.
+    Failed tasks are retried up to ``max_attempts`` times, and tasks left
+    running for longer than ``lease`` seconds are considered abandoned:
+    they are claimed again, unless that was their last attempt, in which
+    case they fail.
+    """
+
+    def __init__(self, keystone_api, batch_size=100, concurrency=None,
+                 max_attempts=3, lease=600):
+        self.keystone = keystone_api
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.lease = lease
+
+    def lease_expiry(self):
+        return datetime.datetime.now() - datetime.timedelta(seconds=self.lease)
+
+    def claimable(self):
+        return (Q(status=ProvisioningTask.PENDING) |
+                Q(status=ProvisioningTask.RUNNING,
+                  claimed_at__lt=self.lease_expiry(),
+                  attempts__lt=self.max_attempts))
+
+    def fail_abandoned(self):
+        """Fail the tasks abandoned during their last attempt.
+
+        A task that keeps crashing its worker would otherwise be claimed
+        again forever.
+        """
+        abandoned = ProvisioningTask.objects \
+            .filter(status=ProvisioningTask.RUNNING,
+                    claimed_at__lt=self.lease_expiry(),
+                    attempts__gte=self.max_attempts)
+        job_ids = set(abandoned.values_list('job_id', flat=True))
+        if job_ids:
+            abandoned.update(status=ProvisioningTask.FAILED,
+                             error='Abandoned by its worker after %d attempts.'
+                             % self.max_attempts)
+            self.finish_jobs(job_ids)
+
+    def claim(self):
+        """Claim a batch of tasks, without locking them.
+
+        Another worker may claim some of the candidates first, the
+        conditional ``UPDATE`` makes sure each task is only claimed once.
+        """
+        self.fail_abandoned()
+        candidates = list(ProvisioningTask.objects
+                          .filter(self.claimable())
+                          .order_by('id')
+                          .values_list('id', flat=True)[:self.batch_size])
+        if not candidates:
+            return []
+        token = uuid.uuid4().hex
+        ProvisioningTask.objects \
+            .filter(self.claimable(), id__in=candidates) \
+            .update(status=ProvisioningTask.RUNNING,
+                    claimed_by=token,
+                    claimed_at=datetime.datetime.now(),
+                    attempts=F('attempts') + 1)
+        tasks = list(ProvisioningTask.objects
+                     .filter(claimed_by=token)
+                     .select_related('user', 'user__project'))
+        ProvisioningJob.objects \
+            .filter(id__in=set(task.job_id for task in tasks),
+                    status=ProvisioningJob.PENDING) \
+            .update(status=ProvisioningJob.RUNNING,
+                    updated=datetime.datetime.now())
+        return tasks
+
+    def run_once(self):
+        """Process one batch of tasks, returning how many were processed."""
+        tasks = self.claim()
+        if not tasks:
+            return 0
+
+        domain = self.keystone.default_domain()
+        default_role = self.keystone.default_role()
+        projects_by_name = keystone.index_projects(self.keystone.projects())
+        default_password = getattr(settings, 'KEYSTONE_USER_PASS', None)
+
+        def process(task):
+            if task.data:
+                data = json.loads(task.data)
+                data['password'] = default_password
+                role_id = data.pop('role_id', None)
+            elif task.user is not None:
+                data = keystone.get_user_data(task.user, projects_by_name,
+                                              default_password)
+                role_id = default_role.id if default_role else None
+            else:
+                return task, None, 'The GARR user no longer exists.', False
+            try:
+                keystone_user, created = keystone.provision_user(
+                    self.keystone, data, domain.id, role_id)
+            except Exception as e:
+                LOG.info('Provisioning task %s failed: %s', task.id, e)
+                return task, None, str(e) or e.__class__.__name__, True
+            return task, keystone_user.id, None, False
+
+        results = keystone.run_concurrently(process, tasks, self.concurrency)
+        for task, keystone_id, error, retry in results:
+            self.finish(task, keystone_id, error, retry)
+        self.finish_jobs(set(task.job_id for task in tasks))
+        return len(tasks)
+
+    def finish(self, task, keystone_id, error, retry=False):
+        values = {'keystone_id': keystone_id, 'error': error or ''}
+        if error is None:
+            values['status'] = ProvisioningTask.DONE
+        elif retry and task.attempts < self.max_attempts:
+            values['status'] = ProvisioningTask.PENDING
+        else:
+            values['status'] = ProvisioningTask.FAILED
+        # The claim token guards against a worker that took over the task
+        # after the lease expired.
+        ProvisioningTask.objects \
+            .filter(id=task.id, claimed_by=task.claimed_by) \
+            .update(**values)
+
+    def finish_jobs(self, job_ids):
+        unfinished = ProvisioningTask.objects \
+            .filter(job_id__in=job_ids,
+                    status__in=(ProvisioningTask.PENDING,
+                                ProvisioningTask.RUNNING)) \
+            .values_list('job_id', flat=True).distinct()
+        ProvisioningJob.objects \
+            .filter(id__in=set(job_ids) - set(unfinished)) \
+            .update(status=ProvisioningJob.DONE,
+                    updated=datetime.datetime.now())
+
+    def run(self):
+        """Process tasks until the queue is empty."""
+        processed = 0
+        while True:
+            count = self.run_once()
+            if not count:
+                return processed
+            processed += count
+
+
+class PasswordResetWorker(object):
+    """Process queued password resets, one job at a time.
+
+    The passwords of a job are hashed by the ``hashing_service`` pool.
+    Jobs are claimed, retried and failed like provisioning tasks.
+    """
+
+    def __init__(self, hashing_service, max_attempts=3, lease=600):
+        self.hashing = hashing_service
+        self.max_attempts = max_attempts
+        self.lease = lease
+
+    def lease_expiry(self):
+        return datetime.datetime.now() - datetime.timedelta(seconds=self.lease)
+
+    def claimable(self):
+        return (Q(status=PasswordResetJob.PENDING) |
+                Q(status=PasswordResetJob.RUNNING,
+                  claimed_at__lt=self.lease_expiry(),
+                  attempts__lt=self.max_attempts))
+
+    def fail_abandoned(self):
+        PasswordResetJob.objects \
+            .filter(status=PasswordResetJob.RUNNING,
+                    claimed_at__lt=self.lease_expiry(),
+                    attempts__gte=self.max_attempts) \
+            .update(status=PasswordResetJob.FAILED,
+                    error='Abandoned by its worker after %d attempts.'
+                    % self.max_attempts,
+                    updated=datetime.datetime.now())
+
+    def claim(self):
+        """Claim the oldest claimable job, ``None`` when there is none."""
+        self.fail_abandoned()
+        candidates = PasswordResetJob.objects \
+            .filter(self.claimable()) \
+            .order_by('id') \
+            .values_list('id', flat=True)[:1]
+        if not candidates:
+            return None
+        token = uuid.uuid4().hex
+        claimed = PasswordResetJob.objects \
+            .filter(self.claimable(), id=candidates[0]) \
+            .update(status=PasswordResetJob.RUNNING,
+                    claimed_by=token,
+                    claimed_at=datetime.datetime.now(),
+                    attempts=F('attempts') + 1,
+                    updated=datetime.datetime.now())
+        if not claimed:
+            # Another worker was first, look for the next job
+            return self.claim()
+        return PasswordResetJob.objects.get(claimed_by=token)
+
+    def reset(self, job):
+        """Reset the passwords of ``job`` and store the credentials.
+
+        The credentials are stored before the new hashes are committed, so
+        the passwords are left unchanged when they can't be stored. Running
+        it again generates new passwords, and replaces the file.
+        """
+        user_ids = job.get_user_ids()
+        users = []
+        for start in range(0, len(user_ids), 500):
+            users.extend(User.objects
+                         .filter(id__in=user_ids[start:start + 500])
+                         .values_list('id', 'name', 'email'))
+        users.sort()
+        passwords = [credentials.generate_password(job.length)
+                     for user in users]
+        hashes = self.hashing.hash_many(passwords)
+        with transaction.atomic():
+            count = User.objects.set_passwords(
+                dict(zip([user[0] for user in users], hashes)))
+            credentials.store(job.owner,
+                              [user + (password,)
+                               for user, password in zip(users, passwords)],
+                              token=job.token)
+        return count
+
+    def run_once(self):
+        """Process one job, returning how many were processed."""
+        job = self.claim()
+        if job is None:
+            return 0
+        values = {'error': '', 'updated': datetime.datetime.now()}
+        try:
+            values['count'] = self.reset(job)
+            values['status'] = PasswordResetJob.DONE
+            LOG.info('Reset the passwords of %d GARR users', values['count'])
+        except Exception as e:
+            LOG.exception('Password reset job %s failed', job.id)
+            values['error'] = str(e) or e.__class__.__name__
+            if job.attempts < self.max_attempts:
+                values['status'] = PasswordResetJob.PENDING
+            else:
+                values['status'] = PasswordResetJob.FAILED
+        PasswordResetJob.objects \
+            .filter(id=job.id, claimed_by=job.claimed_by) \
+            .update(**values)
+        return 1
+
+    def run(self):
+        """Process jobs until the queue is empty."""
+        processed = 0
+        while self.run_once():
+            processed += 1
+        return processed
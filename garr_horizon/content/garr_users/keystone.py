@@ -0,0 +1,512 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Keystone helpers used by the GARR users panel."""
+
+import collections
+import logging
+from multiprocessing.pool import ThreadPool
+import threading
+import time
+
+from django.conf import settings
+from keystoneauth1.identity import v3
+from keystoneauth1 import session
+from keystoneclient import exceptions as keystone_exceptions
+from keystoneclient.v3 import client as keystone_client
+
+from horizon import exceptions
+from openstack_dashboard import api
+
+LOG = logging.getLogger(__name__)
+
+# Errors raised when creating a user whose name is already taken
+CONFLICTS = (exceptions.Conflict, keystone_exceptions.Conflict)
+
+# Lifetime of the cached lookups, in seconds. They can be overridden
+# through the GARR_USERS_KEYSTONE_CACHE_TTL setting.
+DEFAULT_TTLS = {
+    'default_domain': 300,
+    'default_role': 300,
+    'roles': 300,
+    'projects': 60,
+    'users': 60,
+}
+
+# How a GARR user matched a Keystone account, by name or only by email
+MATCH_NAME = 'name'
+MATCH_EMAIL = 'email'
+
+
+class TTLCache(object):
+    """Thread safe, in-process cache whose entries expire after a TTL.
+
+    Keystone resources keep a reference to the client that fetched them
+    and can't be pickled, so they are cached in the memory of each
+    Horizon worker rather than in Django's cache. Expired entries are
+    dropped whenever an entry is written, and at most ``max_entries`` are
+    kept.
+    """
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = collections.Counter()
+        self.misses = collections.Counter()
+
+    def get_or_set(self, key, ttl, loader):
+        """Return the value cached under ``key``, calling ``loader`` on a miss.
+
+        The first item of ``key`` names the lookup, it is what the
+        hit/miss counters are kept for.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.hits[key[0]] += 1
+                return entry[1]
+            self.misses[key[0]] += 1
+        value = loader()
+        with self._lock:
+            self._entries[key] = (now + ttl, value)
+            self._purge(time.time())
+        return value
+
+    def _purge(self, now):
+        """Drop the expired entries, then the oldest ones over the limit.
+
+        Called with the lock held, whenever an entry is written.
+        """
+        for key, entry in list(self._entries.items()):
+            if entry[0] <= now:
+                del self._entries[key]
+        excess = len(self._entries) - self.max_entries
+        if excess > 0:
+            oldest = sorted(self._entries,
+                            key=lambda key: self._entries[key][0])
+            for key in oldest[:excess]:
+                del self._entries[key]
+
+    def invalidate(self, name=None, scope=None):
+        """Drop the entries of the ``name`` lookup for ``scope``.
+
+        Leaving out ``name`` or ``scope`` drops the entries of all
+        lookups or of all scopes.
+        """
+        with self._lock:
+            for key in list(self._entries):
+                if name is not None and key[0] != name:
+                    continue
+                if scope is not None and key[1:] != scope:
+                    continue
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {'hits': dict(self.hits),
+                    'misses': dict(self.misses),
+                    'size': len(self._entries)}
+
+
+cache = TTLCache()
+
+
+def get_scope(request):
+    """Identify the Keystone endpoint, user and token scope of ``request``.
+
+    What Keystone lists depends on the roles of the user, so lookups are
+    never shared between users, even when scoped to the same project.
+    """
+    user = request.user
+    return (getattr(user, 'endpoint', None),
+            getattr(user, 'id', None),
+            getattr(user, 'project_id', None),
+            getattr(user, 'domain_id', None))
+
+
+def _cached(name, request, loader):
+    ttls = dict(DEFAULT_TTLS,
+                **getattr(settings, 'GARR_USERS_KEYSTONE_CACHE_TTL', {}))
+    return cache.get_or_set((name,) + get_scope(request), ttls[name], loader)
+
+
+def invalidate(request=None, name=None):
+    """Drop the cached ``name`` lookup, by default all of them.
+
+    When a request is given, only the entries of its scope are dropped.
+    """
+    scope = get_scope(request) if request is not None else None
+    cache.invalidate(name, scope)
+
+
+def get_default_domain(request):
+    return _cached('default_domain', request,
+                   lambda: api.keystone.get_default_domain(request))
+
+
+def get_default_role(request):
+    return _cached('default_role', request,
+                   lambda: api.keystone.get_default_role(request))
+
+
+def role_list(request):
+    # Return copies, callers are free to sort them
+    return list(_cached('roles', request,
+                        lambda: api.keystone.role_list(request)))
+
+
+def tenant_list(request):
+    projects, has_more = _cached('projects', request,
+                                 lambda: api.keystone.tenant_list(request))
+    return list(projects), has_more
+
+
+class UserIndex(object):
+    """Keystone users of a domain, indexed by name and by email."""
+
+    def __init__(self, keystone_users):
+        self.by_name = {}
+        self.by_email = {}
+        for keystone_user in keystone_users:
+            self.by_name[keystone_user.name] = keystone_user
+            email = getattr(keystone_user, 'email', None)
+            if email:
+                self.by_email.setdefault(email.lower(), keystone_user)
+
+    def match(self, name, email=None):
+        """Return the Keystone user matching a GARR user, and how."""
+        keystone_user = self.by_name.get(name)
+        if keystone_user is not None:
+            return keystone_user, MATCH_NAME
+        keystone_user = self.by_email.get((email or '').lower())
+        if keystone_user is not None:
+            return keystone_user, MATCH_EMAIL
+        return None, None
+
+
+def user_index(request):
+    """``UserIndex`` of the users of the default domain.
+
+    The users are listed with a single Keystone call, cached like the
+    other lookups.
+    """
+    def load():
+        domain = get_default_domain(request)
+        return UserIndex(api.keystone.user_list(request, domain=domain.id))
+    return _cached('users', request, load)
+
+
+def match_users(request, users):
+    """Set the Keystone account of GARR ``users``.
+
+    Each user gets a ``keystone_user`` and a ``keystone_match`` (one of
+    ``MATCH_NAME``, ``MATCH_EMAIL`` or ``None``) attribute, looked up in
+    ``user_index``. When Keystone can't be reached, the attributes are
+    left unset. Returns whether the users were matched.
+    """
+    try:
+        index = user_index(request)
+    except Exception as e:
+        LOG.warning('Unable to list the Keystone users: %s', e)
+        return False
+    for user in users:
+        user.keystone_user, user.keystone_match = index.match(user.name,
+                                                              user.email)
+    return True
+
+
+def create_user(request, data, domain_id):
+    """Create a Keystone user out of the ``data`` of an activation form."""
+    # add extra information
+    if api.keystone.VERSIONS.active >= 3:
+        EXTRA_INFO = getattr(settings, 'USER_TABLE_EXTRA_INFO', {})
+        kwargs = dict((key, data.get(key)) for key in EXTRA_INFO)
+    else:
+        kwargs = {}
+    return api.keystone.user_create(request,
+                                    name=data['name'],
+                                    email=data['email'],
+                                    description=data['description'] or None,
+                                    password=data['password'],
+                                    project=data['project'] or None,
+                                    enabled=data['enabled'],
+                                    domain=domain_id,
+                                    **kwargs)
+
+
+def grant_role(request, user_id, project_id, role_id):
+    """Grant ``role_id`` on ``project_id``, unless the user already has it."""
+    roles = api.keystone.roles_for_user(request, user_id, project_id) or []
+    if not [role for role in roles if role.id == str(role_id)]:
+        api.keystone.add_tenant_user_role(request, project_id, user_id,
+                                          role_id)
+
+
+def service_client():
+    """Keystone client authenticated as the panel's service account.
+
+    It is used outside of requests, by the management commands, where
+    there is no user token to act with. The account is configured by the
+    GARR_USERS_KEYSTONE_CREDENTIALS setting, holding the arguments of a
+    keystoneauth v3 ``Password`` plugin (``auth_url``, ``username``,
+    ``password``, ``project_name``, ``user_domain_name``...).
+    """
+    credentials = getattr(settings, 'GARR_USERS_KEYSTONE_CREDENTIALS')
+    verify = getattr(settings, 'OPENSTACK_SSL_CACERT', None) or \
+        not getattr(settings, 'OPENSTACK_SSL_NO_VERIFY', False)
+    auth = v3.Password(**credentials)
+    return keystone_client.Client(session=session.Session(auth=auth,
+                                                          verify=verify))
+
+
+class RequestKeystone(object):
+    """Keystone calls made with the token of a Horizon request."""
+
+    def __init__(self, request):
+        self.request = request
+
+    def default_domain(self):
+        return get_default_domain(self.request)
+
+    def default_role(self):
+        return get_default_role(self.request)
+
+    def projects(self):
+        return tenant_list(self.request)[0]
+
+    def create_user(self, data, domain_id):
+        return create_user(self.request, data, domain_id)
+
+    def find_user(self, name, domain_id):
+        users = api.keystone.user_list(self.request, domain=domain_id,
+                                       filters={'name': name})
+        return users[0] if users else None
+
+    def users(self, domain_id):
+        return api.keystone.user_list(self.request, domain=domain_id)
+
+    def role_assignments(self, role_id):
+        return api.keystone.role_assignments_list(self.request, role=role_id)
+
+    def disable_user(self, user_id):
+        api.keystone.user_update_enabled(self.request, user_id, False)
+
+    def enable_user(self, user_id):
+        api.keystone.user_update_enabled(self.request, user_id, True)
+
+    def grant_role(self, user_id, project_id, role_id):
+        grant_role(self.request, user_id, project_id, role_id)
+
+
+class ServiceKeystone(object):
+    """Keystone calls made with the service account of ``service_client``.
+
+    The default domain and role are the ones named by Horizon's
+    OPENSTACK_KEYSTONE_DEFAULT_DOMAIN and OPENSTACK_KEYSTONE_DEFAULT_ROLE
+    settings.
+    """
+
+    def __init__(self, client=None):
+        self.client = client or service_client()
+
+    def default_domain(self):
+        name = getattr(settings, 'OPENSTACK_KEYSTONE_DEFAULT_DOMAIN',
+                       'Default')
+        domains = self.client.domains.list(name=name)
+        return domains[0] if domains else self.client.domains.get(name)
+
+    def default_role(self):
+        name = getattr(settings, 'OPENSTACK_KEYSTONE_DEFAULT_ROLE',
+                       '_member_')
+        roles = self.client.roles.list(name=name)
+        return roles[0] if roles else None
+
+    def projects(self):
+        return self.client.projects.list()
+
+    def create_user(self, data, domain_id):
+        return self.client.users.create(
+            name=data['name'],
+            domain=domain_id,
+            password=data['password'],
+            email=data['email'],
+            description=data['description'] or None,
+            default_project=data['project'] or None,
+            enabled=data['enabled'])
+
+    def find_user(self, name, domain_id):
+        users = self.client.users.list(name=name, domain=domain_id)
+        return users[0] if users else None
+
+    def users(self, domain_id):
+        return self.client.users.list(domain=domain_id)
+
+    def role_assignments(self, role_id):
+        return self.client.role_assignments.list(role=role_id)
+
+    def disable_user(self, user_id):
+        self.client.users.update(user_id, enabled=False)
+
+    def enable_user(self, user_id):
+        self.client.users.update(user_id, enabled=True)
+
+    def grant_role(self, user_id, project_id, role_id):
+        # Granting is idempotent in Keystone
+        self.client.roles.grant(role_id, user=user_id, project=project_id)
+
+
+class CountingKeystone(object):
+    """Wrap a Keystone backend, counting the calls made through it."""
+
+    def __init__(self, keystone):
+        self.keystone = keystone
+        self.calls = collections.Counter()
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        method = getattr(self.keystone, name)
+
+        def call(*args, **kwargs):
+            with self._lock:
+                self.calls[name] += 1
+            return method(*args, **kwargs)
+        return call
+
+
+def run_concurrently(function, items, concurrency=None):
+    """Map ``function`` over ``items`` on a bounded pool of threads.
+
+    The pool size defaults to the GARR_USERS_KEYSTONE_CONCURRENCY
+    setting. Results are returned in the order of ``items``.
+    """
+    items = list(items)
+    if not items:
+        return []
+    if concurrency is None:
+        concurrency = getattr(settings, 'GARR_USERS_KEYSTONE_CONCURRENCY', 8)
+    pool = ThreadPool(max(1, min(concurrency, len(items))))
+    try:
+        return pool.map(function, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def gather(**lookups):
+    """Run independent Keystone ``lookups`` concurrently.
+
+    ``lookups`` maps names to callables without arguments. Returns their
+    results by name, so the total latency is about the one of the
+    slowest lookup. The duration of each lookup is logged. The first
+    exception raised by a lookup, in name order, is raised again.
+    """
+    def timed(name):
+        start = time.time()
+        try:
+            return lookups[name](), None
+        except Exception as e:
+            return None, e
+        finally:
+            LOG.debug('Keystone lookup "%s" took %.1f ms', name,
+                      (time.time() - start) * 1000)
+
+    names = sorted(lookups)
+    start = time.time()
+    results = run_concurrently(timed, names, concurrency=len(names))
+    LOG.debug('Keystone lookups %s took %.1f ms', ', '.join(names),
+              (time.time() - start) * 1000)
+    for name, (result, error) in zip(names, results):
+        if error is not None:
+            raise error
+    return dict((name, result) for name, (result, error)
+                in zip(names, results))
+
+
+def provision_user(keystone, data, domain_id, role_id=None):
+    """Make sure a Keystone account matching ``data`` exists.
+
+    An account already using the name is reused rather than treated as
+    an error, so provisioning the same user twice is harmless. When
+    ``data`` has a project, ``role_id`` is granted on it.
+
+    Returns the Keystone user and whether it was created.
+    """
+    try:
+        keystone_user = keystone.create_user(data, domain_id)
+        created = True
+    except CONFLICTS:
+        keystone_user = keystone.find_user(data['name'], domain_id)
+        if keystone_user is None:
+            raise
+        created = False
+    if data['project'] and role_id:
+        keystone.grant_role(keystone_user.id, data['project'], role_id)
+    return keystone_user, created
+
+
+def get_user_data(user, projects_by_name, password):
+    """Activation data of the Keystone account of the GARR ``user``.
+
+    The account's primary project is the Keystone project named like the
+    user's GARR project, looked up in ``projects_by_name``.
+    """
+    project = None
+    if user.project_id is not None:
+        project = projects_by_name.get(user.project.name)
+    return {
+        'name': user.name,
+        'email': user.email,
+        'description': '',
+        'password': password,
+        'project': project.id if project else None,
+        'enabled': True,
+    }
+
+
+def index_projects(keystone_projects):
+    return dict((project.name, project) for project in keystone_projects
+                if project.enabled)
+
+
+ProvisioningResult = collections.namedtuple(
+    'ProvisioningResult', ['user', 'keystone_user', 'created', 'error'])
+
+
+def provision_users(keystone, users, password):
+    """Create Keystone accounts for many GARR ``users`` at once.
+
+    The default domain, the default role and the Keystone projects are
+    fetched once for the whole batch, and the users are matched to their
+    project through a name index. The accounts are then created, and
+    granted the default role on their project, concurrently.
+
+    Returns a ``ProvisioningResult`` per user, in the order of ``users``,
+    whose ``error`` is the exception raised for that user, if any.
+    """
+    domain = keystone.default_domain()
+    default_role = keystone.default_role()
+    projects_by_name = index_projects(keystone.projects())
+    role_id = default_role.id if default_role else None
+
+    def provision(user):
+        data = get_user_data(user, projects_by_name, password)
+        try:
+            keystone_user, created = provision_user(keystone, data,
+                                                    domain.id, role_id)
+        except Exception as e:
+            LOG.info('Unable to create Keystone user "%s": %s', user.name, e)
+            return ProvisioningResult(user, None, False, e)
+        return ProvisioningResult(user, keystone_user, created, None)
+
+    return run_concurrently(provision, users)
@@ -0,0 +1,47 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from django.core.management.base import BaseCommand
+
+from garr_horizon.content.garr_users import expiry
+from garr_horizon.content.garr_users import keystone
+from garr_horizon.content.garr_users.models import User
+
+
+class Command(BaseCommand):
+    help = ('Disable the Keystone accounts of the GARR users whose duration '
+            'is over, using the GARR_USERS_KEYSTONE_CREDENTIALS service '
+            'account.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of users expired at a time.')
+        parser.add_argument('--concurrency', type=int, default=None,
+                            help='Number of concurrent Keystone calls, '
+                                 'GARR_USERS_KEYSTONE_CONCURRENCY by '
+                                 'default.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only count the expired users.')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            self.stdout.write('%d users expired.'
+                              % User.objects.expired().count())
+            return
+        report = expiry.sweep(keystone.ServiceKeystone(),
+                              batch_size=options['batch_size'],
+                              concurrency=options['concurrency'])
+        for name, error in report.failed:
+            self.stderr.write('Unable to disable "%s": %s' % (name, error))
+        self.stdout.write('Expired %d users, disabled %d Keystone accounts, '
+                          '%d failed.' % (report.expired, report.disabled,
+                                          len(report.failed)))
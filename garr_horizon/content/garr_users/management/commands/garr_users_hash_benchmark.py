@@ -0,0 +1,74 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+
+from django.contrib.auth.hashers import get_hasher
+from django.core.management.base import BaseCommand
+
+from garr_horizon.content.garr_users import hashing
+
+
+class Command(BaseCommand):
+    help = ('Measure the password hashes per second of every supported '
+            'HASHING_ALGORITHM on this host, in the calling thread and on '
+            'the hashing pool.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=20,
+                            help='Number of passwords hashed per run.')
+        parser.add_argument('--iterations', type=int, nargs='+',
+                            default=[],
+                            help='Iteration counts to measure besides the '
+                                 'default one of each hasher.')
+        parser.add_argument('--processes', type=int, default=None,
+                            help='Size of the hashing pool, the number of '
+                                 'CPUs by default.')
+
+    def handle(self, *args, **options):
+        service = hashing.HashingService(options['processes'])
+        inline = hashing.HashingService(processes=0)
+        passwords = ['benchmark-%d' % i for i in range(options['count'])]
+
+        self.stdout.write('%-15s %10s %12s %12s' % (
+            'algorithm', 'iterations', 'inline/s',
+            'pool(%d)/s' % service.processes))
+        try:
+            for algorithm in hashing.ALGORITHMS:
+                try:
+                    hasher = get_hasher(algorithm)
+                except ValueError:
+                    self.stdout.write('%-15s not enabled in PASSWORD_HASHERS'
+                                      % algorithm)
+                    continue
+                if hasattr(hasher, 'iterations'):
+                    runs = sorted(set([hasher.iterations] +
+                                      options['iterations']))
+                else:
+                    runs = [None]
+                for iterations in runs:
+                    self.stdout.write('%-15s %10s %12.1f %12.1f' % (
+                        algorithm, iterations or '-',
+                        self.measure(inline, passwords, algorithm,
+                                     iterations),
+                        self.measure(service, passwords, algorithm,
+                                     iterations)))
+        finally:
+            service.close()
+
+    @staticmethod
+    def measure(service, passwords, algorithm, iterations):
+        # Start the pool before timing it
+        service.hash('warm-up', algorithm, iterations)
+        start = time.time()
+        service.hash_many(passwords, algorithm, iterations)
+        return len(passwords) / max(time.time() - start, 1e-6)
@@ -0,0 +1,82 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import csv
+import io
+import multiprocessing
+import os
+import sys
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+import six
+
+from garr_horizon.content.garr_users import importer
+
+
+class Command(BaseCommand):
+    help = 'Import GARR users from a CSV or JSON file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import.')
+        parser.add_argument('--format', choices=importer.FORMATS,
+                            help='Format of the file, guessed from its '
+                                 'extension by default.')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Number of users inserted at a time.')
+        parser.add_argument('--processes', type=int, default=None,
+                            help='Number of processes hashing passwords, '
+                                 'the number of CPUs by default.')
+        parser.add_argument('--report',
+                            help='CSV file the rows which could not be '
+                                 'imported are reported to, instead of '
+                                 'the standard error.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or \
+            os.path.splitext(path)[1].lstrip('.').lower()
+        if file_format not in importer.FORMATS:
+            raise CommandError('Unable to guess the format of "%s", use '
+                               '--format.' % path)
+
+        processes = options['processes']
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        with io.open(path, encoding='utf-8-sig', newline='') as stream:
+            report = importer.import_users(stream, file_format,
+                                           chunk_size=options['chunk_size'],
+                                           processes=processes)
+
+        if report.errors:
+            if options['report']:
+                # The Python 2 csv module only writes bytes
+                if six.PY2:
+                    output = open(options['report'], 'wb')
+                else:
+                    output = io.open(options['report'], 'w', newline='',
+                                     encoding='utf-8')
+                with output:
+                    self.write_report(output, report)
+            else:
+                self.write_report(sys.stderr, report)
+        self.stdout.write('Imported %d users, %d rows failed.'
+                          % (report.created, report.failed))
+
+    @staticmethod
+    def write_report(output, report):
+        writer = csv.writer(output)
+        writer.writerow(('line', 'error'))
+        for line, error in report.errors:
+            if six.PY2:
+                error = error.encode('utf-8')
+            writer.writerow((line, error))
@@ -0,0 +1,66 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from garr_horizon.content.garr_users import keystone
+from garr_horizon.content.garr_users import reconcile
+
+
+class Command(BaseCommand):
+    help = ('Compare the GARR users with the Keystone users, projects and '
+            'role assignments, using the GARR_USERS_KEYSTONE_CREDENTIALS '
+            'service account. The report is also shown by the panel.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true',
+                            help='Create the missing Keystone accounts and '
+                                 'grant the missing roles.')
+        parser.add_argument('--concurrency', type=int, default=None,
+                            help='Number of concurrent Keystone calls when '
+                                 'fixing, GARR_USERS_KEYSTONE_CONCURRENCY '
+                                 'by default.')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Number of GARR users read at a time.')
+        parser.add_argument('--verbose-lists', action='store_true',
+                            help='Print the users and projects found, not '
+                                 'only their number.')
+
+    def handle(self, *args, **options):
+        report = reconcile.run(
+            keystone.ServiceKeystone(),
+            apply_fixes=options['fix'],
+            password=getattr(settings, 'KEYSTONE_USER_PASS', None),
+            concurrency=options['concurrency'],
+            chunk_size=options['chunk_size'])
+
+        sections = (
+            ('GARR users without a Keystone account', report.missing),
+            ('Keystone users without a GARR user', report.orphaned),
+            ('GARR projects missing from Keystone', report.unknown_projects),
+            ('GARR users missing their default role', report.missing_roles),
+        )
+        for title, entries in sections:
+            self.stdout.write('%s: %d' % (title, len(entries)))
+            if options['verbose_lists']:
+                for entry in entries:
+                    self.stdout.write('  %s' % (entry,))
+        if options['fix']:
+            self.stdout.write('Fixed: %d, failed: %d'
+                              % (report.fixed, len(report.fix_errors)))
+            for name, error in report.fix_errors:
+                self.stderr.write('  %s: %s' % (name, error))
+        self.stdout.write('Runtime: %.1f s, Keystone calls: %s' % (
+            report.runtime,
+            ', '.join('%s=%d' % item
+                      for item in sorted(report.api_calls.items()))))
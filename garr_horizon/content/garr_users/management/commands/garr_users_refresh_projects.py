@@ -0,0 +1,43 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from django.core.management.base import BaseCommand
+
+from garr_horizon.content.garr_users import keystone
+from garr_horizon.content.garr_users import projects
+
+
+class Command(BaseCommand):
+    help = ('Refresh the state and remaining time of the GARR projects '
+            'from Keystone, using the GARR_USERS_KEYSTONE_CREDENTIALS '
+            'service account.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', type=int, default=3600,
+                            help='Skip the projects refreshed less than '
+                                 'this many seconds ago.')
+        parser.add_argument('--all', action='store_true',
+                            help='Refresh all the projects.')
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Number of projects read and written at '
+                                 'a time.')
+
+    def handle(self, *args, **options):
+        report = projects.refresh(
+            keystone.ServiceKeystone(),
+            min_age=0 if options['all'] else options['min_age'],
+            chunk_size=options['chunk_size'])
+        self.stdout.write('Scanned %d projects, changed %d, in %.1f s '
+                          '(Keystone calls: %s).' % (
+                              report.scanned, report.changed, report.runtime,
+                              ', '.join('%s=%d' % item for item
+                                        in sorted(report.api_calls.items()))))
@@ -0,0 +1,79 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+
+from garr_horizon.content.garr_users import policies
+from garr_horizon.content.garr_users import tables
+from garr_horizon.content.garr_users.models import User
+
+
+class BenchmarkUser(object):
+    """Keystone admin, as seen by the policy engine."""
+    id = 'benchmark'
+    username = 'benchmark'
+    is_superuser = True
+    project_id = 'benchmark'
+    project_name = 'benchmark'
+    tenant_id = 'benchmark'
+    domain_id = 'default'
+    user_domain_id = 'default'
+    project_domain_id = 'default'
+    roles = [{'name': 'admin'}]
+    authorized_tenants = []
+    token = type('Token', (object,), {'id': 'benchmark',
+                                      'project': {'id': 'benchmark'}})()
+
+    def is_authenticated(self):
+        # Truthy as well when used as an attribute, like Django 1.10 does
+        return True
+
+
+class Command(BaseCommand):
+    help = ('Measure the time spent rendering a page of the users table, '
+            'with and without the per-request memoization of the policy '
+            'checks of its actions.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000,
+                            help='Number of users in the table.')
+        parser.add_argument('--runs', type=int, default=5,
+                            help='Number of renders measured, the best '
+                                 'one is reported.')
+
+    def handle(self, *args, **options):
+        users = [User(id=i, name='user%d' % i, email='user%d@example.org' % i,
+                      idp='idp', duration=0)
+                 for i in range(1, options['rows'] + 1)]
+        for memoize in (False, True):
+            best = min(self.measure(users, memoize)
+                       for run in range(options['runs']))
+            self.stdout.write('%-16s %8.1f ms for %d rows' % (
+                'memoized' if memoize else 'not memoized',
+                best * 1000, len(users)))
+
+    @staticmethod
+    def measure(users, memoize):
+        """Time the rendering of the table, actions included."""
+        request = RequestFactory().get('/')
+        request.user = BenchmarkUser()
+        request.session = {}
+        request.horizon = {'dashboard': None, 'panel': None,
+                           'async_messages': []}
+        policies.memoize(request, memoize)
+        table = tables.UsersTable(request, data=users)
+        start = time.time()
+        table.render()
+        return time.time() - start
@@ -0,0 +1,75 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import multiprocessing
+import time
+
+from django.core.management.base import BaseCommand
+
+from garr_horizon.content.garr_users import hashing
+from garr_horizon.content.garr_users import jobs
+from garr_horizon.content.garr_users import keystone
+
+
+class Command(BaseCommand):
+    help = ('Create the Keystone users queued by the GARR users panel, '
+            'using the GARR_USERS_KEYSTONE_CREDENTIALS service account, '
+            'and reset the queued passwords.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Number of tasks claimed at a time.')
+        parser.add_argument('--concurrency', type=int, default=None,
+                            help='Number of concurrent Keystone calls, '
+                                 'GARR_USERS_KEYSTONE_CONCURRENCY by '
+                                 'default.')
+        parser.add_argument('--processes', type=int, default=None,
+                            help='Number of password hashing processes, '
+                                 'the number of CPUs by default.')
+        parser.add_argument('--max-attempts', type=int, default=3,
+                            help='Number of times a failing task is run.')
+        parser.add_argument('--lease', type=int, default=600,
+                            help='Seconds after which a task left running '
+                                 'is claimed again.')
+        parser.add_argument('--poll', type=int, default=10,
+                            help='Seconds to wait for new tasks when the '
+                                 'queue is empty.')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is empty.')
+
+    def handle(self, *args, **options):
+        worker = jobs.Worker(keystone.ServiceKeystone(),
+                             batch_size=options['batch_size'],
+                             concurrency=options['concurrency'],
+                             max_attempts=options['max_attempts'],
+                             lease=options['lease'])
+        processes = options['processes']
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        service = hashing.HashingService(processes)
+        reset_worker = jobs.PasswordResetWorker(
+            service, max_attempts=options['max_attempts'],
+            lease=options['lease'])
+        try:
+            while True:
+                processed = worker.run()
+                if processed:
+                    self.stdout.write('Processed %d tasks.' % processed)
+                processed = reset_worker.run()
+                if processed:
+                    self.stdout.write('Processed %d password resets.'
+                                      % processed)
+                if options['once']:
+                    return
+                time.sleep(options['poll'])
+        finally:
+            service.close()
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    # The project and user tables usually predate the plugin, apply this
+    # migration with ``migrate --fake-initial`` on existing databases.
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Project',
+            fields=[
+                ('id', models.PositiveIntegerField(primary_key=True,
+                                                   serialize=False)),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('os_id', models.CharField(max_length=40)),
+                ('start', models.DateTimeField()),
+                ('state', models.IntegerField(blank=True, null=True)),
+                ('remaining', models.FloatField(blank=True, null=True)),
+                ('last_update', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'project',
+                'managed': True,
+            },
+        ),
+        migrations.CreateModel(
+            name='User',
+            fields=[
+                ('id', models.PositiveIntegerField(primary_key=True,
+                                                   serialize=False)),
+                ('name', models.CharField(max_length=100)),
+                ('email', models.CharField(max_length=40)),
+                ('password', models.CharField(blank=True, max_length=255,
+                                              null=True)),
+                ('idp', models.CharField(max_length=30)),
+                ('cn', models.CharField(blank=True, max_length=255,
+                                        null=True)),
+                ('source', models.CharField(blank=True, max_length=255,
+                                            null=True)),
+                ('created', models.DateTimeField()),
+                ('duration', models.IntegerField(blank=True, null=True)),
+                ('updated', models.DateTimeField()),
+                ('project', models.ForeignKey(
+                    blank=True, db_column='project', null=True,
+                    on_delete=django.db.models.deletion.DO_NOTHING,
+                    to='garr_users.Project')),
+            ],
+            options={
+                'db_table': 'user',
+                'managed': True,
+            },
+        ),
+    ]
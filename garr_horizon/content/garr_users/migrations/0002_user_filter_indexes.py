@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('garr_users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='name',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='idp',
+            field=models.CharField(db_index=True, max_length=30),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='cn',
+            field=models.CharField(blank=True, db_index=True,
+                                   max_length=255, null=True),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='source',
+            field=models.CharField(blank=True, db_index=True,
+                                   max_length=255, null=True),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='duration',
+            field=models.IntegerField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+MYSQL_FORWARD = (
+    "CREATE FULLTEXT INDEX user_search "
+    "ON `user` (name, email, cn, source, idp)",
+)
+MYSQL_BACKWARD = (
+    "DROP INDEX user_search ON `user`",
+)
+
+# External content FTS5 table, kept in sync with the user table by triggers
+SQLITE_FORWARD = (
+    "CREATE VIRTUAL TABLE user_search USING fts5("
+    "name, email, cn, source, idp, content='user', content_rowid='id')",
+    "CREATE TRIGGER user_search_insert AFTER INSERT ON user BEGIN "
+    "INSERT INTO user_search(rowid, name, email, cn, source, idp) "
+    "VALUES (new.id, new.name, new.email, new.cn, new.source, new.idp); "
+    "END",
+    "CREATE TRIGGER user_search_delete AFTER DELETE ON user BEGIN "
+    "INSERT INTO user_search(user_search, rowid, name, email, cn, source, "
+    "idp) VALUES ('delete', old.id, old.name, old.email, old.cn, "
+    "old.source, old.idp); "
+    "END",
+    "CREATE TRIGGER user_search_update AFTER UPDATE ON user BEGIN "
+    "INSERT INTO user_search(user_search, rowid, name, email, cn, source, "
+    "idp) VALUES ('delete', old.id, old.name, old.email, old.cn, "
+    "old.source, old.idp); "
+    "INSERT INTO user_search(rowid, name, email, cn, source, idp) "
+    "VALUES (new.id, new.name, new.email, new.cn, new.source, new.idp); "
+    "END",
+    "INSERT INTO user_search(user_search) VALUES ('rebuild')",
+)
+SQLITE_BACKWARD = (
+    "DROP TRIGGER user_search_update",
+    "DROP TRIGGER user_search_delete",
+    "DROP TRIGGER user_search_insert",
+    "DROP TABLE user_search",
+)
+
+
+def run(statements):
+    def execute(apps, schema_editor):
+        vendor = schema_editor.connection.vendor
+        for statement in statements.get(vendor, ()):
+            schema_editor.execute(statement)
+    return execute
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('garr_users', '0002_user_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({'mysql': MYSQL_FORWARD, 'sqlite': SQLITE_FORWARD}),
+            run({'mysql': MYSQL_BACKWARD, 'sqlite': SQLITE_BACKWARD})),
+    ]
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('garr_users', '0003_user_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProvisioningJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True,
+                                        serialize=False, verbose_name='ID')),
+                ('owner', models.CharField(max_length=255)),
+                ('status', models.CharField(
+                    choices=[('pending', 'Pending'), ('running', 'Running'),
+                             ('done', 'Done')],
+                    default='pending', max_length=16)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'garr_provisioning_job',
+                'managed': True,
+            },
+        ),
+        migrations.CreateModel(
+            name='ProvisioningTask',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True,
+                                        serialize=False, verbose_name='ID')),
+                ('data', models.TextField(blank=True)),
+                ('password', models.CharField(blank=True, max_length=255,
+                                              null=True)),
+                ('status', models.CharField(
+                    choices=[('pending', 'Pending'), ('running', 'Running'),
+                             ('done', 'Done'), ('failed', 'Failed')],
+                    default='pending', max_length=16)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('claimed_by', models.CharField(blank=True, max_length=32,
+                                                null=True)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('keystone_id', models.CharField(blank=True, max_length=64,
+                                                 null=True)),
+                ('error', models.TextField(blank=True)),
+                ('job', models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE,
+                    related_name='tasks',
+                    to='garr_users.ProvisioningJob')),
+                ('user', models.ForeignKey(
+                    blank=True, db_constraint=False, null=True,
+                    on_delete=django.db.models.deletion.DO_NOTHING,
+                    related_name='+', to='garr_users.User')),
+            ],
+            options={
+                'db_table': 'garr_provisioning_task',
+                'managed': True,
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='provisioningtask',
+            index_together=set([('status', 'claimed_at')]),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('garr_users', '0004_provisioning_jobs'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='updated',
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def set_expiry(apps, schema_editor):
+    # One UPDATE per distinct duration rather than one per user
+    User = apps.get_model('garr_users', 'User')
+    unit = getattr(settings, 'GARR_USERS_DURATION_UNIT', 86400)
+    durations = User.objects.exclude(duration=None) \
+        .order_by().values_list('duration', flat=True).distinct()
+    for duration in list(durations):
+        User.objects.filter(duration=duration).update(
+            expires=models.F('created') +
+            timedelta(seconds=duration * unit))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('garr_users', '0005_user_updated_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='expires',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='expired_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='user',
+            index_together=set([('expired_at', 'expires')]),
+        ),
+        migrations.RunPython(set_expiry, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('garr_users', '0006_user_expiry'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='provisioningtask',
+            name='password',
+        ),
+    ]
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('garr_users', '0007_remove_task_password'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PasswordResetJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True,
+                                        serialize=False, verbose_name='ID')),
+                ('owner', models.CharField(max_length=255)),
+                ('token', models.CharField(max_length=32, unique=True)),
+                ('length', models.PositiveIntegerField()),
+                ('user_ids', models.TextField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('status', models.CharField(
+                    choices=[('pending', 'Pending'), ('running', 'Running'),
+                             ('done', 'Done'), ('failed', 'Failed')],
+                    default='pending', max_length=16)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('claimed_by', models.CharField(blank=True, max_length=32,
+                                                null=True)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'garr_password_reset_job',
+                'managed': True,
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='passwordresetjob',
+            index_together=set([('status', 'claimed_at')]),
+        ),
+    ]
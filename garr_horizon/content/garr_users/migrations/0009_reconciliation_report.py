@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('garr_users', '0008_password_reset_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReconciliationReport',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True,
+                                        serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('data', models.TextField()),
+            ],
+            options={
+                'db_table': 'garr_reconciliation_report',
+                'managed': True,
+            },
+        ),
+    ]
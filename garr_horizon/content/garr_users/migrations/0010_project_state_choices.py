@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('garr_users', '0009_reconciliation_report'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='project',
+            name='state',
+            field=models.IntegerField(
+                blank=True, null=True,
+                choices=[(0, 'Missing from Keystone'), (1, 'Active'),
+                         (2, 'Disabled in Keystone'), (3, 'Expired')]),
+        ),
+        migrations.AlterField(
+            model_name='project',
+            name='last_update',
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
@@ -16,19 +16,138 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 from __future__ import unicode_literals
-from django.contrib.auth.hashers import make_password
-from openstack_dashboard.local.local_settings import HASHING_ALGORITHM
+import re
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
 from django.db import models
+from django.db import transaction
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from datetime import datetime
+from datetime import timedelta
+
+from garr_horizon.content.garr_users import hashing
+
+PROJECT_CHOICES_VERSION_KEY = 'garr_users:project_choices:version'
+PROJECT_CHOICES_KEY = 'garr_users:project_choices:%s'
+
+
+def update_rows(queryset, rows, chunk_size=500, **extra):
+    """Set different values on each row of ``queryset``.
+
+    ``rows`` maps row ids to a dict of their new field values, all rows
+    having the same fields. Rows are updated ``chunk_size`` at a time,
+    each chunk with a single ``UPDATE ... SET field = CASE id WHEN ...
+    END, ... WHERE id IN (...)`` statement, which also sets the ``extra``
+    values. Returns the number of updated rows.
+    """
+    ids = sorted(rows)
+    if not ids:
+        return 0
+    fields = sorted(rows[ids[0]])
+    updated = 0
+    with transaction.atomic(using=queryset.db):
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            values = dict(extra)
+            for field in fields:
+                values[field] = models.Case(
+                    *[models.When(id=row_id,
+                                  then=models.Value(rows[row_id][field]))
+                      for row_id in chunk],
+                    output_field=queryset.model._meta.get_field(field))
+            updated += queryset.filter(id__in=chunk).update(**values)
+    return updated
+
+
+def update_by_id(queryset, field, values, chunk_size=500, **extra):
+    """Set a different ``field`` value on each row of ``queryset``.
+
+    ``values`` maps row ids to their new value, see ``update_rows``.
+    """
+    return update_rows(queryset,
+                       dict((row_id, {field: value})
+                            for row_id, value in values.items()),
+                       chunk_size, **extra)
+
+
+def get_duration(duration):
+    """Length of a user ``duration``, in GARR_USERS_DURATION_UNIT seconds.
+
+    The unit defaults to a day.
+    """
+    unit = getattr(settings, 'GARR_USERS_DURATION_UNIT', 86400)
+    return timedelta(seconds=duration * unit)
+
+
+def get_expiry(created, duration):
+    """Expiry time of a user created at ``created``, if it expires."""
+    if duration is None or created is None:
+        return None
+    return created + get_duration(duration)
+
+
+class ProjectManager(models.Manager):
+
+    def choices_version(self):
+        """Version of the projects, bumped whenever a project changes."""
+        version = cache.get(PROJECT_CHOICES_VERSION_KEY)
+        if version is None:
+            # Start from the current time, so that a version key evicted
+            # from the cache never brings back stale choices.
+            cache.add(PROJECT_CHOICES_VERSION_KEY, int(time.time()), None)
+            version = cache.get(PROJECT_CHOICES_VERSION_KEY)
+        return version
+
+    def choices(self):
+        """Return the ``(id, name)`` list of all projects, sorted by name.
+
+        The list is kept in Django's cache, shared by all the Horizon
+        workers, under a versioned key. Saving or deleting a project bumps
+        the version, which invalidates it everywhere at once.
+        """
+        key = PROJECT_CHOICES_KEY % self.choices_version()
+        choices = cache.get(key)
+        if choices is None:
+            choices = list(self.order_by('name').values_list('id', 'name'))
+            timeout = getattr(settings, 'GARR_USERS_PROJECT_CHOICES_TTL', 300)
+            cache.set(key, choices, timeout)
+        return choices
+
+    def invalidate_choices(self):
+        try:
+            cache.incr(PROJECT_CHOICES_VERSION_KEY)
+        except ValueError:
+            # The version key is missing, the next lookup creates a new one
+            pass
+
 
 class Project(models.Model):
+    # Values of ``state``, set by the project refresher (see projects.py)
+    MISSING = 0
+    ACTIVE = 1
+    DISABLED = 2
+    EXPIRED = 3
+    STATE_CHOICES = ((MISSING, 'Missing from Keystone'),
+                     (ACTIVE, 'Active'),
+                     (DISABLED, 'Disabled in Keystone'),
+                     (EXPIRED, 'Expired'))
+
     id = models.PositiveIntegerField(primary_key=True)
     name = models.CharField(unique=True, max_length=255)
     os_id = models.CharField(max_length=40)
     start = models.DateTimeField()
-    state = models.IntegerField(blank=True, null=True)
+    state = models.IntegerField(choices=STATE_CHOICES, blank=True, null=True)
+    # Whole days left before the end of the project
     remaining = models.FloatField(blank=True, null=True)
-    last_update = models.DateTimeField()
+    # Indexed for the refresher to find the stale projects
+    last_update = models.DateTimeField(db_index=True)
+
+    objects = ProjectManager()
 
     class Meta:
         managed = True
@@ -37,47 +156,351 @@ class Project(models.Model):
     def __str__(self):
         return self.name
 
+# Filter match modes, picked from the filter string by parse_filter():
+#
+#   exact     ``value``    ``= 'value'``, index seek.
+#   iexact    ``~value``   ``LIKE 'value'``, index seek on MySQL, whose
+#                          default collations are case insensitive.
+#   prefix    ``value*``   ``LIKE 'value%'``, index range scan.
+#   contains  ``*value*``  ``LIKE '%value%'``, can't use an index and scans
+#                          the whole table.
+FILTER_LOOKUPS = {
+    'exact': 'exact',
+    'iexact': 'iexact',
+    'prefix': 'istartswith',
+    'contains': 'icontains',
+}
+
+
+def parse_filter(filter_string):
+    """Split a filter string into a ``(mode, value)`` tuple."""
+    if len(filter_string) > 2 and filter_string.startswith('*') \
+            and filter_string.endswith('*'):
+        return 'contains', filter_string[1:-1]
+    if len(filter_string) > 1 and filter_string.endswith('*'):
+        return 'prefix', filter_string[:-1]
+    if len(filter_string) > 1 and filter_string.startswith('~'):
+        return 'iexact', filter_string[1:]
+    return 'exact', filter_string
+
+
+# Columns covered by the full-text search index
+SEARCH_FIELDS = ('name', 'email', 'cn', 'source', 'idp')
+SEARCH_INDEX = 'user_search'
+
+
+class UserQuerySet(models.QuerySet):
+    # Columns displayed by the users table
+    LIST_FIELDS = ('id', 'name', 'email', 'idp', 'cn', 'source', 'duration',
+                   'project', 'project__name')
+
+    # Filterable fields, mapped to the column they are matched against.
+    # Every text column is indexed, the project name through the unique
+    # index of the joined project table.
+    FILTER_FIELDS = {
+        'name': 'name',
+        'idp': 'idp',
+        'cn': 'cn',
+        'source': 'source',
+        'project': 'project__name',
+    }
+    # Numeric fields only support exact matches
+    NUMERIC_FILTER_FIELDS = ('id', 'duration')
+
+    def filter_by(self, field, filter_string):
+        """Filter the users on ``field`` using the ``filter_string`` mode.
+
+        Values that can't match anything, like unknown project names or
+        non numeric ids, result in an empty queryset instead of an error.
+        """
+        if field == 'search':
+            return self.search(filter_string)
+        if field == 'expiring':
+            try:
+                return self.expiring(int(filter_string))
+            except ValueError:
+                return self.none()
+        if field in self.NUMERIC_FILTER_FIELDS:
+            try:
+                return self.filter(**{field: int(filter_string)})
+            except ValueError:
+                return self.none()
+        if field not in self.FILTER_FIELDS:
+            return self.none()
+        mode, value = parse_filter(filter_string)
+        lookup = '%s__%s' % (self.FILTER_FIELDS[field], FILTER_LOOKUPS[mode])
+        return self.filter(**{lookup: value})
+
+    def search(self, query):
+        """Full-text search over name, email, cn, source and idp.
+
+        Every word of ``query`` has to match the beginning of a word in one
+        of those columns. Users are annotated with a ``rank``, higher
+        meaning more relevant, to be sorted on. MySQL uses the
+        ``user_search`` FULLTEXT index and SQLite the ``user_search`` FTS5
+        table, other databases fall back to substring matches.
+        """
+        terms = re.findall(r'\w+', query, re.UNICODE)
+        if not terms:
+            return self.none()
+
+        connection = connections[self.db]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        if connection.vendor == 'mysql':
+            columns = ', '.join('%s.%s' % (table, connection.ops.quote_name(f))
+                                for f in SEARCH_FIELDS)
+            match = 'MATCH (%s) AGAINST (%%s IN BOOLEAN MODE)' % columns
+            against = ' '.join('+%s*' % term for term in terms)
+            return self.annotate(rank=RawSQL(match, (against,))) \
+                .extra(where=[match], params=[against])
+
+        if connection.vendor == 'sqlite':
+            expression = ' '.join('"%s"*' % term for term in terms)
+            matches = ('%s.id IN (SELECT rowid FROM %s WHERE %s MATCH %%s)'
+                       % (table, SEARCH_INDEX, SEARCH_INDEX))
+            # FTS5 ranks are negative, the lower the more relevant
+            rank = ('-(SELECT rank FROM %s WHERE %s MATCH %%s '
+                    'AND rowid = %s.id)' % (SEARCH_INDEX, SEARCH_INDEX, table))
+            return self.annotate(rank=RawSQL(rank, (expression,))) \
+                .extra(where=[matches], params=[expression])
+
+        condition = models.Q()
+        for term in terms:
+            term_condition = models.Q()
+            for field in SEARCH_FIELDS:
+                term_condition |= models.Q(**{field + '__icontains': term})
+            condition &= term_condition
+        return self.filter(condition).annotate(
+            rank=models.Value(0, output_field=models.FloatField()))
+
+    def bulk_delete(self, ids, chunk_size=1000):
+        """Delete the users with the given ``ids``, in a single transaction.
+
+        Users are deleted ``chunk_size`` at a time, each chunk with a
+        single ``DELETE ... WHERE id IN (...)`` statement. Returns the
+        number of deleted users, ids of missing users are ignored.
+        """
+        ids = list(ids)
+        deleted = 0
+        with transaction.atomic(using=self.db):
+            for start in range(0, len(ids), chunk_size):
+                chunk = ids[start:start + chunk_size]
+                deleted += self.filter(id__in=chunk).delete()[0]
+        return deleted
+
+    def bulk_edit(self, **values):
+        """Set ``values`` on all the users with one ``UPDATE`` statement.
+
+        The ``updated`` timestamp of the users is bumped as well, and
+        their ``expires`` time when the duration changes. Users marked
+        expired that the new duration no longer expires (see ``renewed``)
+        are unmarked, their Keystone accounts are left to enable again.
+        Returns the number of updated users.
+        """
+        values.setdefault('updated', datetime.now())
+        if 'duration' in values and 'expires' not in values:
+            duration = values['duration']
+            if duration is None:
+                values['expires'] = None
+                values['expired_at'] = None
+            else:
+                values['expires'] = models.F('created') + \
+                    get_duration(duration)
+                values['expired_at'] = models.Case(
+                    models.When(self.renewed_condition(duration,
+                                                       values['updated']),
+                                then=models.Value(None)),
+                    default=models.F('expired_at'),
+                    output_field=models.DateTimeField())
+        return self.update(**values)
+
+    @staticmethod
+    def renewed_condition(duration, now):
+        """Users that a ``duration`` doesn't expire at ``now``."""
+        if duration is None:
+            return models.Q()
+        return models.Q(created__gt=now - get_duration(duration))
+
+    def renewed(self, duration, now=None):
+        """Users marked expired that ``duration`` would no longer expire."""
+        return self.filter(self.renewed_condition(duration,
+                                                  now or datetime.now()),
+                           expired_at__isnull=False)
+
+    def expired(self, now=None):
+        """Users expired at ``now`` and not yet marked as such.
+
+        Both the sweeper and the expiring filter select users by a range
+        of the ``(expired_at, expires)`` index.
+        """
+        return self.filter(expired_at__isnull=True,
+                           expires__lte=now or datetime.now())
+
+    def expiring(self, days, now=None):
+        """Users expiring within ``days`` days from ``now``."""
+        now = now or datetime.now()
+        return self.filter(expired_at__isnull=True, expires__gt=now,
+                           expires__lte=now + timedelta(days=days))
+
+    def set_passwords(self, hashes, chunk_size=500):
+        """Store the password ``hashes``, a dict of user id to hash.
+
+        The users are updated with chunked ``UPDATE`` statements, in a
+        single transaction, and their ``updated`` timestamp is bumped.
+        Returns the number of updated users.
+        """
+        return update_by_id(self, 'password', hashes, chunk_size,
+                            updated=datetime.now())
+
+    def set_password(self, password_hash):
+        """Store the same ``password_hash`` on all the users.
+
+        A single ``UPDATE`` statement, which bumps their ``updated``
+        timestamp. Returns the number of updated users.
+        """
+        return self.update(password=password_hash, updated=datetime.now())
+
+    def listing(self):
+        """Only load the columns displayed by the users table.
+
+        The project name is joined in the same query. The remaining
+        columns (the password hash, ``created``, ``updated``) are deferred
+        and only loaded if they are accessed.
+        """
+        return self.select_related('project').only(*self.LIST_FIELDS)
+
+    def chunked(self, size=1000):
+        """Iterate over the users, fetching ``size`` rows at a time.
+
+        Unlike ``iterator()``, which still gets the whole result set
+        buffered by the MySQL client, memory stays bounded by ``size``.
+        Users are always yielded in ``id`` order.
+        """
+        marker = None
+        while True:
+            queryset = self.order_by('id')
+            if marker is not None:
+                queryset = queryset.filter(id__gt=marker)
+            users = list(queryset[:size])
+            for user in users:
+                yield user
+            if len(users) < size:
+                return
+            marker = users[-1].id
+
+    def seek(self, marker=None, limit=None, sort_key='id', reverse=False):
+        """Return a keyset-paginated page of users and a "more" flag.
+
+        Rows are ordered on ``sort_key`` (``-`` prefixed for a descending
+        order) with ``id`` as the tie breaker, which has to be a non null
+        column. Instead of an ``OFFSET``, the page starts right after the
+        ``marker`` row, so fetching a page costs the same no matter how
+        deep into the table it is. With ``reverse`` the page ends right
+        before ``marker`` instead, which is how previous pages are fetched.
+        """
+        field = sort_key.lstrip('-')
+        descending = sort_key.startswith('-') != reverse
+        direction = '-' if descending else ''
+        lookup = 'lt' if descending else 'gt'
+
+        queryset = self
+        if field == 'id':
+            queryset = queryset.order_by(direction + 'id')
+        else:
+            queryset = queryset.order_by(direction + field, direction + 'id')
+
+        if marker is not None:
+            if field == 'id':
+                queryset = queryset.filter(**{'id__' + lookup: marker})
+            else:
+                value = self.filter(id=marker).values_list(field, flat=True)
+                value = list(value[:1])
+                if value:
+                    queryset = queryset.filter(
+                        models.Q(**{field + '__' + lookup: value[0]}) |
+                        models.Q(**{field: value[0], 'id__' + lookup: marker}))
+
+        if limit is None:
+            users, has_more = list(queryset), False
+        else:
+            users = list(queryset[:limit + 1])
+            has_more = len(users) > limit
+            users = users[:limit]
+        if reverse:
+            users.reverse()
+        return users, has_more
+
+
+class UpdateConflict(Exception):
+    """The user was changed or deleted since the update was prepared."""
+
+
 class User(models.Model):
     id = models.PositiveIntegerField(primary_key=True)
-    name = models.CharField(max_length=100)
+    name = models.CharField(max_length=100, db_index=True)
     email = models.CharField(max_length=40)
     password = models.CharField(max_length=255, blank=True, null=True)
-    idp = models.CharField(max_length=30)
-    cn = models.CharField(max_length=255, blank=True, null=True)
-    source = models.CharField(max_length=255, blank=True, null=True)
+    idp = models.CharField(max_length=30, db_index=True)
+    cn = models.CharField(max_length=255, blank=True, null=True,
+                          db_index=True)
+    source = models.CharField(max_length=255, blank=True, null=True,
+                              db_index=True)
     created = models.DateTimeField()
-    duration = models.IntegerField(blank=True, null=True)
+    duration = models.IntegerField(blank=True, null=True, db_index=True)
     project = models.ForeignKey(Project, models.DO_NOTHING, db_column='project', blank=True, null=True)
-    updated = models.DateTimeField()
+    updated = models.DateTimeField(db_index=True)
+    # created + duration, kept in sync to find expired users by index
+    expires = models.DateTimeField(blank=True, null=True)
+    # When the sweeper disabled the Keystone account of the expired user
+    expired_at = models.DateTimeField(blank=True, null=True)
+
+    objects = UserQuerySet.as_manager()
 
     class Meta:
         managed = True
         db_table = 'user'
+        index_together = (('expired_at', 'expires'),)
 
     def __str__(self):
         return self.name
 
+    # Fields of a user which can be edited
+    EDITABLE_FIELDS = ('name', 'email', 'idp', 'cn', 'source', 'project',
+                       'duration')
+
     @staticmethod
-    def update_user(user_data):
-        user = User.objects.get(id=int(user_data['id']))
-        user.name = user_data['name']
-        user.email = user_data['email']
-        user.idp = user_data['idp']
-        user.cn = user_data['cn']
-        user.source = user_data['source']
-        if str(user_data['project']) != '':
-            user.project = Project.objects.get(id=int(user_data['project']))
-        else:
-            user.project = None
-        user.duration = user_data['duration']
-        user.updated = datetime.now()
-        user.save()
+    def update_user(user_data, changed_fields=None, version=None):
+        """Write the ``changed_fields`` of ``user_data`` with one ``UPDATE``.
+
+        All the editable fields present in ``user_data`` are written when
+        ``changed_fields`` isn't given. ``version`` is the ``updated``
+        timestamp of the user the changes are based on: if the user was
+        updated since, nothing is written and ``UpdateConflict`` is raised.
+        """
+        if changed_fields is None:
+            changed_fields = user_data
+        values = {}
+        for field in User.EDITABLE_FIELDS:
+            if field not in changed_fields or field not in user_data:
+                continue
+            if field == 'project':
+                project = user_data['project']
+                values['project_id'] = \
+                    int(project) if str(project) != '' else None
+            else:
+                values[field] = user_data[field]
+        if not values:
+            return
+
+        users = User.objects.filter(id=int(user_data['id']))
+        if version is not None:
+            users = users.filter(updated=version)
+        if not users.bulk_edit(**values):
+            raise UpdateConflict()
 
     @staticmethod
     def hash_password(password):
-        return make_password(
-            password, hasher=HASHING_ALGORITHM
-        )
+        return hashing.hash_password(password)
 
     @staticmethod
     def create_user(user_data):
@@ -86,6 +509,7 @@ class User(models.Model):
         else:
             project = None
         hashed_pass = User.hash_password(user_data['password'])
+        now = datetime.now()
         new_user = User(
             name=user_data['name'],
             email=user_data['email'],
@@ -95,6 +519,136 @@ class User(models.Model):
             source=user_data['source'],
             project=project,
             duration=user_data['duration'],
-            created=datetime.now()
+            created=now,
+            updated=now,
+            expires=get_expiry(now, user_data['duration'])
         )
         new_user.save()
+
+
+class ProvisioningJob(models.Model):
+    """Batch of Keystone users created in background by the worker."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    STATUS_CHOICES = ((PENDING, 'Pending'),
+                      (RUNNING, 'Running'),
+                      (DONE, 'Done'))
+
+    owner = models.CharField(max_length=255)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES,
+                              default=PENDING)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        managed = True
+        db_table = 'garr_provisioning_job'
+
+    def __str__(self):
+        return '%s' % self.id
+
+
+class ProvisioningTask(models.Model):
+    """Creation of a single Keystone user, part of a ``ProvisioningJob``.
+
+    Tasks of the Keystone create action only reference the GARR user, the
+    account is built out of its current data when the task runs. Custom
+    activations store the submitted form ``data`` (as JSON) instead. No
+    password is stored, the worker gives accounts the default one.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = ((PENDING, 'Pending'),
+                      (RUNNING, 'Running'),
+                      (DONE, 'Done'),
+                      (FAILED, 'Failed'))
+
+    job = models.ForeignKey(ProvisioningJob, models.CASCADE,
+                            related_name='tasks')
+    user = models.ForeignKey(User, models.DO_NOTHING, db_constraint=False,
+                             blank=True, null=True, related_name='+')
+    data = models.TextField(blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES,
+                              default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    claimed_by = models.CharField(max_length=32, blank=True, null=True)
+    claimed_at = models.DateTimeField(blank=True, null=True)
+    keystone_id = models.CharField(max_length=64, blank=True, null=True)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        managed = True
+        db_table = 'garr_provisioning_task'
+        index_together = (('status', 'claimed_at'),)
+
+    def __str__(self):
+        return '%s' % self.id
+
+
+class PasswordResetJob(models.Model):
+    """Reset of the passwords of ``user_ids`` to generated ones.
+
+    The passwords are generated and hashed by the worker, and the file of
+    credentials is kept by ``credentials`` under ``token``, for the
+    ``owner`` to download. Neither is stored in the database.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = ((PENDING, 'Pending'),
+                      (RUNNING, 'Running'),
+                      (DONE, 'Done'),
+                      (FAILED, 'Failed'))
+
+    owner = models.CharField(max_length=255)
+    token = models.CharField(max_length=32, unique=True)
+    length = models.PositiveIntegerField()
+    # Comma separated ids of the GARR users
+    user_ids = models.TextField()
+    count = models.PositiveIntegerField(default=0)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES,
+                              default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    claimed_by = models.CharField(max_length=32, blank=True, null=True)
+    claimed_at = models.DateTimeField(blank=True, null=True)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        managed = True
+        db_table = 'garr_password_reset_job'
+        index_together = (('status', 'claimed_at'),)
+
+    def __str__(self):
+        return '%s' % self.id
+
+    def get_user_ids(self):
+        return [int(user_id) for user_id in self.user_ids.split(',')
+                if user_id]
+
+
+class ReconciliationReport(models.Model):
+    """Report of a ``garr_users_reconcile`` run, shown by the panel.
+
+    The report is kept as JSON in ``data``, see ``reconcile.Report``.
+    """
+    created = models.DateTimeField(auto_now_add=True)
+    data = models.TextField()
+
+    class Meta:
+        managed = True
+        db_table = 'garr_reconciliation_report'
+
+    def __str__(self):
+        return '%s' % self.id
+
+
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+def invalidate_project_choices(sender, **kwargs):
+    Project.objects.invalidate_choices()
@@ -0,0 +1,110 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Policy and capability checks memoized for the length of a request.
+
+A users table page asks the same questions for every row: whether the
+Keystone backend is editable and whether each row action's policy rules
+pass. The answers only change with the policy target, so they are kept
+on the request and rules whose target doesn't depend on the row are
+evaluated once per page instead of once per row.
+"""
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+import six
+
+from horizon import tables
+
+from openstack_dashboard import api
+
+
+def get_policy_check():
+    """The POLICY_CHECK_FUNCTION of the settings, ``None`` without one."""
+    policy_check = getattr(settings, 'POLICY_CHECK_FUNCTION', None)
+    if isinstance(policy_check, six.string_types):
+        policy_check = import_string(policy_check)
+    return policy_check
+
+
+def _memo(request):
+    """The memo of ``request``, ``None`` when memoization is turned off."""
+    try:
+        return request._garr_policy_memo
+    except AttributeError:
+        request._garr_policy_memo = {}
+        return request._garr_policy_memo
+
+
+def memoize(request, enabled=True):
+    """Turn the memoization of the checks of ``request`` on or off.
+
+    Only meant to measure the cost of the checks without memoization.
+    """
+    request._garr_policy_memo = {} if enabled else None
+
+
+def check(rules, request, target=None):
+    """Check ``rules`` with POLICY_CHECK_FUNCTION, memoized on ``request``.
+
+    The answers are memoized by rules and target. Without a policy check
+    function, like in Horizon, every rule passes.
+    """
+    policy_check = get_policy_check()
+    if not policy_check:
+        return True
+    target = dict(target or {})
+    memo = _memo(request)
+    try:
+        key = ('policy', tuple(rules), tuple(sorted(target.items())))
+        hash(key)
+    except TypeError:
+        # Targets holding unhashable values are not memoized
+        memo = None
+    if memo is None:
+        return policy_check(rules, request, target)
+    if key not in memo:
+        # The policy engine fills in missing target attributes, keep the
+        # target of the key unchanged.
+        memo[key] = policy_check(rules, request, dict(target))
+    return memo[key]
+
+
+def can_edit_user(request):
+    """``keystone_can_edit_user``, memoized on ``request``."""
+    memo = _memo(request)
+    if memo is None:
+        return api.keystone.keystone_can_edit_user()
+    if 'can_edit_user' not in memo:
+        memo['can_edit_user'] = api.keystone.keystone_can_edit_user()
+    return memo['can_edit_user']
+
+
+class MemoizedPolicyMixin(object):
+    """Table action mixin checking its policy rules through ``check``.
+
+    Actions whose policy target doesn't depend on the row (no
+    ``PolicyTargetMixin``, or target attributes the row doesn't have)
+    are checked once per request, the others once per distinct target.
+    Replaces Horizon's ``_allowed``, which would check the rules again,
+    and keeps its rule of not showing batch actions on empty tables.
+    """
+
+    def _allowed(self, request, datum):
+        if isinstance(self, tables.BatchAction) and \
+                not self.table.data and not datum:
+            return False
+        if self.policy_rules and not check(
+                self.policy_rules, request,
+                self.get_policy_target(request, datum)):
+            return False
+        return self.allowed(request, datum)
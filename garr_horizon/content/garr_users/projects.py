@@ -0,0 +1,117 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Refresh of the ``state`` and ``remaining`` columns of GARR projects.
+
+The Keystone projects are listed with a single call and indexed by id,
+the GARR projects are read in chunks and matched to them by ``os_id``.
+Projects refreshed less than ``min_age`` seconds ago are skipped, through
+the index on ``last_update``, so the refresher can run often and only go
+through the stale projects.
+
+``state`` takes the values of ``Project.STATE_CHOICES``: ``MISSING`` (0)
+without a Keystone project, ``DISABLED`` (2) when the Keystone project is
+disabled, ``EXPIRED`` (3) once the project ended, else ``ACTIVE`` (1).
+Projects end ``GARR_USERS_PROJECT_DURATION`` days after their ``start``,
+and ``remaining`` is the number of whole days left until then. Without
+the setting, projects don't expire and ``remaining`` is left untouched.
+"""
+
+from datetime import datetime
+from datetime import timedelta
+import time
+
+from django.conf import settings
+
+from garr_horizon.content.garr_users import keystone
+from garr_horizon.content.garr_users.models import Project
+from garr_horizon.content.garr_users.models import update_rows
+
+
+class RefreshReport(object):
+
+    def __init__(self):
+        self.scanned = 0
+        self.changed = 0
+        self.runtime = 0.0
+        self.api_calls = {}
+
+
+def compute(project, keystone_project, now, duration=None):
+    """Return the new column values of ``project`` at ``now``.
+
+    ``remaining`` is only computed with a project ``duration``, in days.
+    Whole days are stored, so unchanged projects are written at most
+    once a day.
+    """
+    values = {}
+    end = None
+    if duration is not None:
+        end = project.start + timedelta(days=duration)
+        values['remaining'] = float(max((end - now).days, 0))
+    if keystone_project is None:
+        values['state'] = Project.MISSING
+    elif not keystone_project.enabled:
+        values['state'] = Project.DISABLED
+    elif end is not None and end <= now:
+        values['state'] = Project.EXPIRED
+    else:
+        values['state'] = Project.ACTIVE
+    return values
+
+
+def refresh(keystone_api, min_age=3600, chunk_size=500, now=None):
+    """Refresh the projects not refreshed for ``min_age`` seconds.
+
+    Only the projects whose state or remaining time changed are written,
+    with chunked ``update_rows`` statements, the ``last_update`` of the
+    others is bumped with one ``UPDATE`` per chunk. Returns a
+    ``RefreshReport``.
+    """
+    counting = keystone.CountingKeystone(keystone_api)
+    start = time.time()
+    now = now or datetime.now()
+    report = RefreshReport()
+    keystone_projects = dict((project.id, project)
+                             for project in counting.projects())
+    duration = getattr(settings, 'GARR_USERS_PROJECT_DURATION', None)
+
+    stale = Project.objects.filter(
+        last_update__lt=now - timedelta(seconds=min_age)) \
+        .only('id', 'os_id', 'start', 'state', 'remaining') \
+        .order_by('id')
+    marker = None
+    while True:
+        chunk = stale if marker is None else stale.filter(id__gt=marker)
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            break
+        marker = chunk[-1].id
+        report.scanned += len(chunk)
+
+        changes = {}
+        for project in chunk:
+            values = compute(project, keystone_projects.get(project.os_id),
+                             now, duration)
+            if any(getattr(project, field) != value
+                   for field, value in values.items()):
+                changes[project.id] = values
+        report.changed += update_rows(Project.objects, changes, chunk_size,
+                                      last_update=now)
+        unchanged = [project.id for project in chunk
+                     if project.id not in changes]
+        if unchanged:
+            Project.objects.filter(id__in=unchanged).update(last_update=now)
+
+    report.runtime = time.time() - start
+    report.api_calls = dict(counting.calls)
+    return report
@@ -0,0 +1,221 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Reconciliation of the GARR users with Keystone.
+
+Both sides are loaded in bulk: the GARR users are streamed from the
+database with their project name, the Keystone users, projects and role
+assignments of the default role are listed with one call each. They are
+then compared with dict and set joins, matching users by name and GARR
+projects to the Keystone projects of the same name, like the Keystone
+create actions do. No Keystone call is made per user, unless fixes are
+applied.
+
+The last report is stored in the database, where every Horizon process
+finds it.
+"""
+
+from datetime import datetime
+import functools
+import json
+import logging
+import time
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.dateparse import parse_datetime
+import six
+
+from garr_horizon.content.garr_users import keystone
+from garr_horizon.content.garr_users.models import ReconciliationReport
+from garr_horizon.content.garr_users.models import User
+
+LOG = logging.getLogger(__name__)
+
+# Number of entries of each list kept in the stored report
+REPORT_LIMIT = 500
+
+
+class Report(object):
+    """Differences between the GARR users and Keystone.
+
+    - ``missing``: GARR users without a Keystone account.
+    - ``orphaned``: Keystone users of the domain without a GARR user.
+    - ``unknown_projects``: GARR projects, having users, without an
+      enabled Keystone project of the same name.
+    - ``missing_roles``: GARR users whose Keystone account lacks the
+      default role on the Keystone project of their GARR project.
+
+    Missing users and roles are lists of ``(id, name)`` of GARR users.
+    ``grants`` maps the GARR ids of the users missing their role to the
+    Keystone ``(user id, project id)`` to grant it on, it isn't stored.
+    """
+    LISTS = ('missing', 'orphaned', 'unknown_projects', 'missing_roles',
+             'fix_errors')
+
+    def __init__(self):
+        self.missing = []
+        self.orphaned = []
+        self.unknown_projects = []
+        self.missing_roles = []
+        self.grants = {}
+        self.fixed = 0
+        self.fix_errors = []
+        self.runtime = 0.0
+        self.api_calls = {}
+        self.finished = None
+
+    def as_dict(self, limit=None):
+        """The report as a dict, with lists cut to ``limit`` entries.
+
+        The full length of each list is kept as ``<list>_count``.
+        """
+        data = dict(self.__dict__)
+        del data['grants']
+        for name in self.LISTS:
+            data[name + '_count'] = len(data[name])
+            data[name] = data[name][:limit]
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        report = cls()
+        report.__dict__.update(data)
+        # JSON turns the tuples of the lists into lists
+        for name in cls.LISTS:
+            setattr(report, name, [tuple(entry) if isinstance(entry, list)
+                                   else entry
+                                   for entry in getattr(report, name)])
+        if isinstance(report.finished, six.string_types):
+            report.finished = parse_datetime(report.finished)
+        return report
+
+
+def get_assignments(keystone_api, role_id):
+    """Set of the ``(user id, project id)`` pairs granted ``role_id``."""
+    assignments = set()
+    for assignment in keystone_api.role_assignments(role_id):
+        user = getattr(assignment, 'user', None)
+        project = getattr(assignment, 'scope', {}).get('project')
+        if user and project:
+            assignments.add((user['id'], project['id']))
+    return assignments
+
+
+def reconcile(keystone_api, chunk_size=1000):
+    """Compare the GARR users with the Keystone side of ``keystone_api``.
+
+    Returns a ``Report``.
+    """
+    report = Report()
+    domain = keystone_api.default_domain()
+    default_role = keystone_api.default_role()
+    projects_by_name = keystone.index_projects(keystone_api.projects())
+    keystone_users = dict((user.name, user)
+                          for user in keystone_api.users(domain.id))
+    assignments = get_assignments(keystone_api, default_role.id) \
+        if default_role else None
+
+    garr_names = set()
+    unknown_projects = set()
+    users = User.objects.select_related('project') \
+        .only('id', 'name', 'project', 'project__name')
+    for user in users.chunked(chunk_size):
+        garr_names.add(user.name)
+        project = None
+        if user.project_id is not None:
+            project = projects_by_name.get(user.project.name)
+            if project is None:
+                unknown_projects.add(user.project.name)
+        keystone_user = keystone_users.get(user.name)
+        if keystone_user is None:
+            report.missing.append((user.id, user.name))
+        elif project is not None and assignments is not None and \
+                (keystone_user.id, project.id) not in assignments:
+            report.missing_roles.append((user.id, user.name))
+            report.grants[user.id] = (keystone_user.id, project.id)
+
+    report.orphaned = sorted(set(keystone_users) - garr_names)
+    report.unknown_projects = sorted(unknown_projects)
+    return report
+
+
+def fix(keystone_api, report, password, concurrency=None):
+    """Create the missing accounts and grant the missing roles.
+
+    Missing accounts are provisioned like the Keystone create actions do,
+    which also grants them the default role. Existing accounts lacking
+    the role are granted it directly, with a single call each. Both run
+    on a pool of ``concurrency`` threads.
+    """
+    if not report.missing and not report.missing_roles:
+        return
+    default_role = keystone_api.default_role()
+    role_id = default_role.id if default_role else None
+
+    fixes = []
+    if report.missing:
+        users = User.objects.select_related('project') \
+            .only('id', 'name', 'email', 'project', 'project__name') \
+            .filter(id__in=[user_id for user_id, name in report.missing])
+        domain = keystone_api.default_domain()
+        projects_by_name = keystone.index_projects(keystone_api.projects())
+        for user in users:
+            data = keystone.get_user_data(user, projects_by_name, password)
+            fixes.append((user.name, functools.partial(
+                keystone.provision_user, keystone_api, data, domain.id,
+                role_id)))
+    if role_id is not None:
+        for user_id, name in report.missing_roles:
+            keystone_user_id, project_id = report.grants[user_id]
+            fixes.append((name, functools.partial(
+                keystone_api.grant_role, keystone_user_id, project_id,
+                role_id)))
+
+    def apply_fix(item):
+        name, function = item
+        try:
+            function()
+        except Exception as e:
+            LOG.info('Unable to fix Keystone user "%s": %s', name, e)
+            return name, str(e) or e.__class__.__name__
+        return name, None
+
+    for name, error in keystone.run_concurrently(apply_fix, fixes,
+                                                 concurrency):
+        if error is None:
+            report.fixed += 1
+        else:
+            report.fix_errors.append((name, error))
+
+
+def run(keystone_api, apply_fixes=False, password=None, concurrency=None,
+        chunk_size=1000):
+    """Reconcile, optionally fix, and store the report for the panel."""
+    counting = keystone.CountingKeystone(keystone_api)
+    start = time.time()
+    report = reconcile(counting, chunk_size)
+    if apply_fixes:
+        fix(counting, report, password, concurrency)
+    report.runtime = time.time() - start
+    report.api_calls = dict(counting.calls)
+    report.finished = datetime.now()
+    stored = ReconciliationReport.objects.create(
+        data=json.dumps(report.as_dict(REPORT_LIMIT), cls=DjangoJSONEncoder))
+    ReconciliationReport.objects.filter(id__lt=stored.id).delete()
+    return report
+
+
+def last_report():
+    stored = ReconciliationReport.objects.order_by('-id').first()
+    if stored is None:
+        return None
+    return Report.from_dict(json.loads(stored.data))
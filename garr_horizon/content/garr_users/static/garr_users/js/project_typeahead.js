@@ -0,0 +1,49 @@
+/**
+ * Completes GARR project names in the user forms.
+ *
+ * Suggestions are fetched from the URL in the input's data-url attribute
+ * and offered through its datalist. The id of the project matching the
+ * typed name is stored in the hidden input named by data-target, the
+ * typed text is stored instead when nothing matches, so the server side
+ * validation rejects it.
+ */
+(function ($) {
+  'use strict';
+
+  var DELAY = 250;
+  var timer = null;
+
+  function select($input) {
+    var name = $input.val();
+    var value = name;
+    $('#' + $input.attr('list')).children('option').each(function () {
+      if (this.value === name) {
+        value = $(this).data('id');
+        return false;
+      }
+    });
+    $('#' + $input.data('target')).val(value);
+  }
+
+  function lookup($input) {
+    $.getJSON($input.data('url'), {q: $input.val()}, function (data) {
+      var $list = $('#' + $input.attr('list')).empty();
+      $.each(data.projects, function (index, project) {
+        $('<option>')
+          .attr('value', project.name)
+          .data('id', project.id)
+          .appendTo($list);
+      });
+      select($input);
+    });
+  }
+
+  $(document).on('input', 'input.garr-project-typeahead', function () {
+    var $input = $(this);
+    select($input);
+    clearTimeout(timer);
+    timer = setTimeout(function () {
+      lookup($input);
+    }, DELAY);
+  });
+})(jQuery);
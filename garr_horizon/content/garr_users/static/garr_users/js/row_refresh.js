@@ -0,0 +1,54 @@
+/**
+ * Keeps the rows of the GARR users table up to date.
+ *
+ * The ids of the displayed rows are sent in a single request to the URL
+ * in the data-url attribute of the table container, which renders only
+ * the rows updated since the previous poll (data-since). Those rows are
+ * replaced in place, keeping their selection checkbox.
+ */
+(function ($) {
+  'use strict';
+
+  var INTERVAL = 10000;
+
+  function refresh($container) {
+    var $rows = $container.find('tbody tr[data-object-id]');
+    if (!$rows.length || document.hidden) {
+      return $.when();
+    }
+    var ids = $rows.map(function () {
+      return $(this).attr('data-object-id');
+    }).get();
+    return $.getJSON($container.data('url'), {
+      ids: ids.join(','),
+      since: $container.data('since')
+    }).done(function (data) {
+      $container.data('since', data.since);
+      $.each(data.rows, function (id, html) {
+        var $row = $rows.filter('[data-object-id="' + id + '"]');
+        var $new = $(html);
+        $new.find('.table-row-multi-select')
+          .prop('checked',
+                $row.find('.table-row-multi-select').prop('checked'));
+        $row.replaceWith($new);
+      });
+    });
+  }
+
+  function poll($container) {
+    setTimeout(function () {
+      // Stop when the table is no longer on the page
+      if ($.contains(document, $container[0])) {
+        refresh($container).always(function () {
+          poll($container);
+        });
+      }
+    }, INTERVAL);
+  }
+
+  horizon.addInitFunction(function () {
+    $('.garr-users-rows').each(function () {
+      poll($(this));
+    });
+  });
+})(jQuery);
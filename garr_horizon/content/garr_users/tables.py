@@ -11,20 +11,33 @@
 # under the License.
 
 
+from django.conf import settings
+from django.core.urlresolvers import reverse
+from django import shortcuts
 from django.template import defaultfilters
+from django.utils import http
 from django.utils.translation import ugettext_lazy as _
 from django.utils.translation import ungettext_lazy
 
+from horizon import exceptions
 from horizon import forms
+from horizon import messages
 from horizon import tables
-from openstack_dashboard import api
 from openstack_dashboard import policy
 
+from garr_horizon.content.garr_users import jobs
+from garr_horizon.content.garr_users import keystone
+from garr_horizon.content.garr_users import policies
+from garr_horizon.content.garr_users.models import ProvisioningJob
 from garr_horizon.content.garr_users.models import User
-from garr_horizon.content.garr_users.forms import ActivateUserForm
 from openstack_dashboard.local.local_settings import KEYSTONE_USER_PASS
 
-class ActivateUserLink(tables.LinkAction):
+def has_keystone_user(user):
+    """Whether the GARR ``user`` already has a Keystone account."""
+    return getattr(user, 'keystone_match', None) == keystone.MATCH_NAME
+
+
+class ActivateUserLink(policies.MemoizedPolicyMixin, tables.LinkAction):
     name = "activate"
     verbose_name = _("Custom Keystone Create")
     url = "horizon:identity:garr_users:activate"
@@ -36,10 +49,10 @@ class ActivateUserLink(tables.LinkAction):
                     ("identity", "identity:list_projects"),)
 
     def allowed(self, request, user):
-        return api.keystone.keystone_can_edit_user()
+        return policies.can_edit_user(request) and not has_keystone_user(user)
 
 
-class CreateUserLink(tables.LinkAction):
+class CreateUserLink(policies.MemoizedPolicyMixin, tables.LinkAction):
     name = "create"
     verbose_name = _("Create User")
     url = "horizon:identity:garr_users:create"
@@ -51,10 +64,31 @@ class CreateUserLink(tables.LinkAction):
                     ("identity", "identity:list_projects"),)
 
     def allowed(self, request, user):
-        return api.keystone.keystone_can_edit_user()
+        return policies.can_edit_user(request)
+
+
+class ImportUsersLink(policies.MemoizedPolicyMixin, tables.LinkAction):
+    name = "import"
+    verbose_name = _("Import Users")
+    url = "horizon:identity:garr_users:import"
+    classes = ("ajax-modal",)
+    icon = "upload"
+    policy_rules = (("identity", "identity:create_user"),)
+
+    def allowed(self, request, user):
+        return policies.can_edit_user(request)
+
 
+class ExportUsersLink(policies.MemoizedPolicyMixin, tables.LinkAction):
+    name = "export"
+    verbose_name = _("Export Users")
+    url = "horizon:identity:garr_users:export"
+    icon = "download"
+    policy_rules = (("identity", "identity:list_users"),)
 
-class EditUserLink(policy.PolicyTargetMixin, tables.LinkAction):
+
+class EditUserLink(policies.MemoizedPolicyMixin, policy.PolicyTargetMixin,
+                   tables.LinkAction):
     name = "edit"
     verbose_name = _("Edit")
     url = "horizon:identity:garr_users:update"
@@ -67,10 +101,78 @@ class EditUserLink(policy.PolicyTargetMixin, tables.LinkAction):
 
 
     def allowed(self, request, user):
-        return api.keystone.keystone_can_edit_user()
+        return policies.can_edit_user(request)
+
+
+class BulkEditUsersAction(policies.MemoizedPolicyMixin, tables.Action):
+    name = "bulk_edit"
+    verbose_name = _("Edit Users")
+    icon = "pencil"
+    requires_input = True
+    handles_multiple = True
+    policy_rules = (("identity", "identity:update_user"),)
+
+    def allowed(self, request, user):
+        return policies.can_edit_user(request)
+
+    def handle(self, table, request, obj_ids):
+        url = reverse("horizon:identity:garr_users:bulk_update")
+        return shortcuts.redirect('%s?%s' % (
+            url, http.urlencode({'ids': ','.join(obj_ids)})))
+
+
+def is_filtered(table):
+    """Whether the users of ``table`` are filtered."""
+    return bool(table.get_filter_string())
+
+
+class BulkEditFilteredUsersLink(policies.MemoizedPolicyMixin,
+                                tables.LinkAction):
+    name = "bulk_edit_filtered"
+    verbose_name = _("Edit Filtered Users")
+    url = "horizon:identity:garr_users:bulk_update"
+    classes = ("ajax-modal",)
+    icon = "pencil"
+    policy_rules = (("identity", "identity:update_user"),)
+
+    def allowed(self, request, user):
+        # Without a filter, the link would edit the whole table
+        return policies.can_edit_user(request) and is_filtered(self.table)
+
+
+class ResetPasswordsAction(policies.MemoizedPolicyMixin, tables.Action):
+    name = "reset_passwords"
+    verbose_name = _("Reset Passwords")
+    icon = "key"
+    requires_input = True
+    handles_multiple = True
+    policy_rules = (("identity", "identity:update_user"),)
+
+    def allowed(self, request, user):
+        return policies.can_edit_user(request)
+
+    def handle(self, table, request, obj_ids):
+        url = reverse("horizon:identity:garr_users:reset_passwords")
+        return shortcuts.redirect('%s?%s' % (
+            url, http.urlencode({'ids': ','.join(obj_ids)})))
 
 
-class ChangePasswordLink(policy.PolicyTargetMixin, tables.LinkAction):
+class ResetFilteredPasswordsLink(policies.MemoizedPolicyMixin,
+                                 tables.LinkAction):
+    name = "reset_filtered_passwords"
+    verbose_name = _("Reset Filtered Passwords")
+    url = "horizon:identity:garr_users:reset_passwords"
+    classes = ("ajax-modal",)
+    icon = "key"
+    policy_rules = (("identity", "identity:update_user"),)
+
+    def allowed(self, request, user):
+        # Without a filter, the link would reset every password
+        return policies.can_edit_user(request) and is_filtered(self.table)
+
+
+class ChangePasswordLink(policies.MemoizedPolicyMixin,
+                         policy.PolicyTargetMixin, tables.LinkAction):
     name = "change_password"
     verbose_name = _("Change Password")
     url = "horizon:identity:garr_users:change_password"
@@ -80,9 +182,10 @@ class ChangePasswordLink(policy.PolicyTargetMixin, tables.LinkAction):
     policy_target_attrs = (("user_id", "id"),)
 
     def allowed(self, request, user):
-        return api.keystone.keystone_can_edit_user()
+        return policies.can_edit_user(request)
 
-class DeleteUsersAction(policy.PolicyTargetMixin, tables.DeleteAction):
+class DeleteUsersAction(policies.MemoizedPolicyMixin,
+                        policy.PolicyTargetMixin, tables.DeleteAction):
     @staticmethod
     def action_present(count):
         return ungettext_lazy(
@@ -101,15 +204,56 @@ class DeleteUsersAction(policy.PolicyTargetMixin, tables.DeleteAction):
     policy_rules = (("identity", "identity:delete_user"),)
 
     def allowed(self, request, datum):
-        if not api.keystone.keystone_can_edit_user() or \
-                (datum and datum.id == request.user.id):
+        # Users can't delete the GARR user of their own account
+        if not policies.can_edit_user(request) or \
+                (datum and datum.name == request.user.username):
             return False
         return True
 
     def delete(self, request, obj_id):
         User.objects.filter(id=obj_id).delete()
 
-class EnableUsersAction(tables.BatchAction):
+    def handle(self, table, request, obj_ids):
+        # Delete all the selected users at once, instead of running
+        # delete() once per user like DeleteAction does. The policy
+        # target only depends on Keystone attributes GARR users don't
+        # have, so checking it once covers every selected user.
+        if not self._allowed(request, None):
+            messages.error(request, _('You are not allowed to delete '
+                                      'users.'))
+            return shortcuts.redirect(self.get_success_url(request))
+
+        ids = set()
+        skipped = 0
+        for obj_id in obj_ids:
+            try:
+                user_id = int(obj_id)
+            except ValueError:
+                skipped += 1
+                continue
+            ids.add(user_id)
+        # Users can't delete the GARR user of their own account
+        own = ids.intersection(
+            User.objects.filter(name=request.user.username)
+            .values_list('id', flat=True))
+        skipped += len(own)
+        ids -= own
+
+        try:
+            deleted = User.objects.bulk_delete(sorted(ids))
+        except Exception:
+            exceptions.handle(request, _('Unable to delete users.'))
+            return shortcuts.redirect(self.get_success_url(request))
+        skipped += len(ids) - deleted
+        if deleted:
+            messages.success(request, _('Deleted %d users.') % deleted)
+        if skipped:
+            messages.warning(request, _('Skipped %d users, which could not '
+                                        'be deleted or no longer exist.')
+                             % skipped)
+        return shortcuts.redirect(self.get_success_url(request))
+
+class EnableUsersAction(policies.MemoizedPolicyMixin, tables.BatchAction):
     policy_rules = (('identity', 'identity:create_grant'),
                     ("identity", "identity:create_user"),
                     ("identity", "identity:list_roles"),
@@ -119,40 +263,50 @@ class EnableUsersAction(tables.BatchAction):
     icon = "plus"
     success_url = "horizon:identity:garr_users:index"
 
-    def action(self, request, user_id):
-        self.enable(request, user_id)
-
     def allowed(self, request, user):
-        return api.keystone.keystone_can_edit_user()
-
-    def enable(self, request, user_id):
-        domain = api.keystone.get_default_domain(request)
-        default_role = api.keystone.get_default_role(request)
-        keystone_projects, has_more = api.keystone.tenant_list(request)
-        try:
-            user_obj = User.objects.get(id=user_id)
-        except Exception:
-            msg = _('Unable to find user with the following id - %d' % user_id)
-            messages.error(request, msg)
-
-        default_project = None
-        if user_obj.project:
-            for project in keystone_projects:
-                if user_obj.project == project.name:
-                    default_project = project.name
-        user_data = {
-            'name': user_obj.name,
-            'email': user_obj.email,
-            'description': '',
-            'password': KEYSTONE_USER_PASS,
-            'project': default_project,
-            'enabled': True
-        }
-
-        keystone_user = ActivateUserForm.create_keystone_user(request, user_data)
-        if not keystone_user:
-            msg = _('Unable to create user, %s, in keystone' % user_obj.name)
-            messages.error(request, msg)
+        return policies.can_edit_user(request) and not has_keystone_user(user)
+
+    def handle(self, table, request, obj_ids):
+        # Provision all the selected users in one go, instead of running
+        # action() once per user like BatchAction does. Large selections
+        # are left to the background worker.
+        if not self._allowed(request, None):
+            messages.error(request, _('You are not allowed to create '
+                                      'Keystone users.'))
+            return shortcuts.redirect(self.get_success_url(request))
+
+        threshold = getattr(settings, 'GARR_USERS_BACKGROUND_THRESHOLD', 50)
+        if threshold is not None and len(obj_ids) >= threshold:
+            job = jobs.enqueue_users(request.user.username, obj_ids)
+            messages.success(request, _('The creation of %(count)d Keystone '
+                                        'users was queued as job %(job)s.')
+                             % {'count': len(obj_ids), 'job': job.id})
+            return shortcuts.redirect(self.get_success_url(request))
+
+        users = User.objects.select_related('project') \
+            .only('id', 'name', 'email', 'project', 'project__name') \
+            .filter(id__in=obj_ids)
+        results = keystone.provision_users(keystone.RequestKeystone(request),
+                                           users, KEYSTONE_USER_PASS)
+        keystone.invalidate(request, 'users')
+        created = [r.user.name for r in results if r.created]
+        existing = [r.user.name for r in results
+                    if r.error is None and not r.created]
+        failed = [r.user.name for r in results if r.error is not None]
+        missing = len(obj_ids) - len(results)
+        if created:
+            messages.success(request, _('Created Keystone users: "%s".')
+                             % '", "'.join(created))
+        if existing:
+            messages.info(request, _('Keystone users already existing: '
+                                     '"%s".') % '", "'.join(existing))
+        if failed:
+            messages.error(request, _('Unable to create Keystone users: '
+                                      '"%s".') % '", "'.join(failed))
+        if missing:
+            messages.error(request, _('Unable to find %d of the selected '
+                                      'users.') % missing)
+        return shortcuts.redirect(self.get_success_url(request))
 
     @staticmethod
     def action_present(count):
@@ -170,14 +324,32 @@ class EnableUsersAction(tables.BatchAction):
             count
         )
 
+class ProvisioningJobsLink(policies.MemoizedPolicyMixin, tables.LinkAction):
+    name = "jobs"
+    verbose_name = _("Keystone Jobs")
+    url = "horizon:identity:garr_users:jobs"
+    icon = "tasks"
+    policy_rules = (("identity", "identity:create_user"),)
+
+
+class ReconciliationLink(policies.MemoizedPolicyMixin, tables.LinkAction):
+    name = "reconciliation"
+    verbose_name = _("Keystone Reconciliation")
+    url = "horizon:identity:garr_users:reconciliation"
+    icon = "random"
+    policy_rules = (("identity", "identity:list_users"),)
+
+
 class UserFilterAction(tables.FilterAction):
     filter_type = "server"
-    filter_choices = (("name", _("User Name"), True),
+    filter_choices = (("search", _("Search"), True),
+                      ("name", _("User Name"), True),
                       ("id", _("User ID"), True),
                       ("idp", _("Identity Provider"), True),
                       ("cn", _("Common Name"), True),
                       ("source", _("Source"), True),
                       ("duration", _("Duration"), True),
+                      ("expiring", _("Expiring Within (days)"), True),
                       ("project", _("User Project"), True))
 
 
@@ -185,7 +357,27 @@ class UpdateRow(tables.Row):
     ajax = True
 
     def get_data(self, request, user_id):
-        return User.objects.filter(id=user_id)
+        user = User.objects.listing().get(id=user_id)
+        keystone.match_users(request, [user])
+        return user
+
+
+def get_keystone_account(user):
+    if not hasattr(user, 'keystone_match'):
+        return _('Unknown')
+    if user.keystone_match == keystone.MATCH_NAME:
+        return _('Yes')
+    if user.keystone_match == keystone.MATCH_EMAIL:
+        return _('Same email as "%s"') % user.keystone_user.name
+    return _('No')
+
+
+def get_project_name(user):
+    # The project is expected to be fetched along with the user
+    # (select_related), so this doesn't cost a query per row.
+    if user.project_id is None:
+        return '-'
+    return user.project.name
 
 
 class UsersTable(tables.DataTable):
@@ -212,7 +404,7 @@ class UsersTable(tables.DataTable):
                           verbose_name=_('Identity Provider'),
                           form_field=forms.CharField(required=False))
 
-    project = tables.Column(lambda obj: str(getattr(obj, 'project', '-')),
+    project = tables.Column(get_project_name,
                             verbose_name=_('Project'),
                             form_field=forms.CharField(required=False))
 
@@ -227,10 +419,38 @@ class UsersTable(tables.DataTable):
     duration = tables.Column(lambda obj: getattr(obj, 'duration', None),
                           verbose_name=_('Duration'),
                           form_field=forms.IntegerField(required=True))
+
+    keystone_account = tables.Column(get_keystone_account,
+                                     verbose_name=_('Keystone Account'))
+
     class Meta(object):
         name = "users"
         verbose_name = _("Users")
         row_actions = (EnableUsersAction, ActivateUserLink, EditUserLink, ChangePasswordLink, DeleteUsersAction)
-        table_actions = (UserFilterAction, EnableUsersAction, CreateUserLink, DeleteUsersAction)
+        table_actions = (UserFilterAction, EnableUsersAction, CreateUserLink,
+                         ImportUsersLink, ExportUsersLink,
+                         BulkEditUsersAction, BulkEditFilteredUsersLink,
+                         ResetPasswordsAction, ResetFilteredPasswordsLink,
+                         ProvisioningJobsLink, ReconciliationLink,
+                         DeleteUsersAction)
         row_class = UpdateRow
 
+
+def get_job_progress(job):
+    return _('%(done)d done, %(failed)d failed, %(total)d total') % {
+        'done': job.done, 'failed': job.failed, 'total': job.total}
+
+
+class ProvisioningJobsTable(tables.DataTable):
+    id = tables.Column('id', verbose_name=_('Job ID'),
+                       link="horizon:identity:garr_users:job_detail")
+    owner = tables.Column('owner', verbose_name=_('Owner'))
+    created = tables.Column('created', verbose_name=_('Created'))
+    updated = tables.Column('updated', verbose_name=_('Last Update'))
+    status = tables.Column('status', verbose_name=_('Status'),
+                           display_choices=ProvisioningJob.STATUS_CHOICES)
+    progress = tables.Column(get_job_progress, verbose_name=_('Progress'))
+
+    class Meta(object):
+        name = "jobs"
+        verbose_name = _("Keystone Jobs")
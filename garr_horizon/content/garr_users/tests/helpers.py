@@ -0,0 +1,92 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+
+"""Fixtures shared by the GARR users tests.
+
+The ``user`` and ``project`` tables predate the plugin and assign ids
+themselves, the test database is created from the migrations and
+doesn't, so fixtures set their ids explicitly.
+"""
+
+from datetime import datetime
+
+from django.contrib.messages.storage import default_storage
+from django.test import RequestFactory
+
+from garr_horizon.content.garr_users.models import Project
+from garr_horizon.content.garr_users.models import User
+
+
+def create_projects(count, start=1):
+    now = datetime.now()
+    projects = [Project(id=i, name='project%d' % i, os_id='os%d' % i,
+                        start=now, last_update=now)
+                for i in range(start, start + count)]
+    Project.objects.bulk_create(projects)
+    return projects
+
+
+def create_users(count, start=1, projects=(), **fields):
+    """Create ``count`` users, spread over ``projects``."""
+    now = datetime.now()
+    users = []
+    for i in range(start, start + count):
+        values = {
+            'id': i,
+            'name': 'user%d' % i,
+            'email': 'user%d@example.org' % i,
+            'idp': 'idp%d' % (i % 3),
+            'cn': 'User %d' % i,
+            'source': 'source%d' % (i % 5),
+            'duration': 30,
+            'created': now,
+            'updated': now,
+            'project': projects[i % len(projects)] if projects else None,
+        }
+        values.update(fields)
+        users.append(User(**values))
+    User.objects.bulk_create(users, batch_size=500)
+    return users
+
+
+class AdminUser(object):
+    """Keystone admin, as seen by the views and the policy engine."""
+    id = 'admin'
+    username = 'admin'
+    is_superuser = True
+    project_id = 'admin'
+    project_name = 'admin'
+    tenant_id = 'admin'
+    domain_id = 'default'
+    user_domain_id = 'default'
+    project_domain_id = 'default'
+    roles = [{'name': 'admin'}]
+    authorized_tenants = []
+    token = type('Token', (object,), {'id': 'admin',
+                                      'project': {'id': 'admin'}})()
+
+    def is_authenticated(self):
+        # Truthy as well when used as an attribute, like Django 1.10 does
+        return True
+
+
+def make_request(path='/', ajax=False, **params):
+    """GET request of an admin, ``params`` being its query parameters."""
+    headers = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'} if ajax else {}
+    request = RequestFactory().get(path, params, **headers)
+    request.user = AdminUser()
+    request.session = {}
+    request.horizon = {'dashboard': None, 'panel': None,
+                       'async_messages': []}
+    request._messages = default_storage(request)
+    return request
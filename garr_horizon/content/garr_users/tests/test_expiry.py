@@ -0,0 +1,156 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+
+from datetime import datetime
+from datetime import timedelta
+
+from django.test import TestCase
+
+from garr_horizon.content.garr_users import expiry
+from garr_horizon.content.garr_users import forms
+from garr_horizon.content.garr_users.models import User
+from garr_horizon.content.garr_users.models import UserQuerySet
+from garr_horizon.content.garr_users.tests import helpers
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+class FakeKeystone(object):
+    """Keystone holding an enabled account for each of ``names``."""
+
+    def __init__(self, names):
+        self.accounts = dict((name, True) for name in names)
+
+    def default_domain(self):
+        return mock.Mock(id='default')
+
+    def users(self, domain_id):
+        users = []
+        for name, enabled in self.accounts.items():
+            user = mock.Mock(id=name, enabled=enabled)
+            user.name = name
+            users.append(user)
+        return users
+
+    def disable_user(self, user_id):
+        self.accounts[user_id] = False
+
+    def enable_user(self, user_id):
+        self.accounts[user_id] = True
+
+
+class SweepTest(TestCase):
+
+    def setUp(self):
+        self.created = datetime.now() - timedelta(days=40)
+        # Users 1 to 5 expired 10 days ago, 6 to 10 expire in 20 days
+        helpers.create_users(5, created=self.created, duration=30,
+                             expires=self.created + timedelta(days=30))
+        helpers.create_users(5, start=6, created=self.created, duration=60,
+                             expires=self.created + timedelta(days=60))
+
+    def sweep(self, keystone_api, **kwargs):
+        kwargs.setdefault('concurrency', 1)
+        return expiry.sweep(keystone_api, **kwargs)
+
+    def test_sweep(self):
+        keystone_api = FakeKeystone(['user1', 'user2', 'user6'])
+        now = datetime.now().replace(microsecond=0)
+        report = self.sweep(keystone_api, batch_size=2, now=now)
+        self.assertEqual(2, report.disabled)
+        self.assertEqual({'user1': False, 'user2': False, 'user6': True},
+                         keystone_api.accounts)
+        # Only the disabled users are marked, and their rows refreshed
+        self.assertEqual(
+            [('user1', now, now), ('user2', now, now)],
+            list(User.objects.filter(expired_at__isnull=False)
+                 .order_by('id').values_list('name', 'expired_at',
+                                             'updated')))
+
+    def test_account_created_after_expiry(self):
+        self.sweep(FakeKeystone([]))
+        self.assertFalse(User.objects.filter(expired_at__isnull=False)
+                         .exists())
+        keystone_api = FakeKeystone(['user3'])
+        report = self.sweep(keystone_api)
+        self.assertEqual(1, report.disabled)
+        self.assertFalse(keystone_api.accounts['user3'])
+
+    def test_batch_query_doesnt_grow(self):
+        queries = []
+        values_list = UserQuerySet.values_list
+
+        def record(queryset, *fields, **kwargs):
+            queries.append(str(queryset.query))
+            return values_list(queryset, *fields, **kwargs)
+
+        with mock.patch.object(UserQuerySet, 'values_list', record):
+            self.sweep(FakeKeystone([]), batch_size=1)
+        # One query per expired user and a last empty one, all the pages
+        # after the first one with the same keyset condition
+        self.assertEqual(6, len(queries))
+        self.assertEqual(1, len(set(query.count(' OR ')
+                                    for query in queries[1:])))
+
+
+class RenewTest(TestCase):
+
+    def setUp(self):
+        projects = helpers.create_projects(1)
+        created = datetime.now() - timedelta(days=40)
+        self.user = helpers.create_users(
+            1, projects=projects, created=created, duration=30,
+            expires=created + timedelta(days=30),
+            expired_at=created + timedelta(days=30))[0]
+        self.request = helpers.make_request()
+        patcher = mock.patch.object(expiry, 'reactivate', return_value=[])
+        self.reactivate = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def edit(self, **changes):
+        data = {'id': self.user.id, 'version': self.user.updated.isoformat(),
+                'name': self.user.name, 'email': self.user.email,
+                'project': self.user.project_id, 'idp': self.user.idp,
+                'cn': self.user.cn, 'source': self.user.source,
+                'duration': self.user.duration}
+        initial = dict(data)
+        data.update(changes)
+        with mock.patch('openstack_dashboard.api.keystone.'
+                        'keystone_can_edit_user', return_value=True):
+            form = forms.UpdateUserForm(self.request, data=data,
+                                        initial=initial)
+            self.assertTrue(form.is_valid(), form.errors)
+            self.assertTrue(form.handle(self.request, form.cleaned_data))
+
+    def test_edit_renews(self):
+        self.edit(duration=60)
+        user = User.objects.get(id=self.user.id)
+        self.assertIsNone(user.expired_at)
+        self.assertEqual(1, self.reactivate.call_count)
+        self.assertEqual(['user1'], self.reactivate.call_args[0][1])
+
+    def test_edit_keeps_expired(self):
+        self.edit(duration=35)
+        self.assertIsNotNone(User.objects.get(id=self.user.id).expired_at)
+        self.assertFalse(self.reactivate.called)
+
+    def test_bulk_edit_renews(self):
+        form = forms.BulkUpdateUserForm(
+            self.request, data={'ids': str(self.user.id), 'duration': 60})
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertTrue(form.handle(self.request, form.cleaned_data))
+        self.assertIsNone(User.objects.get(id=self.user.id).expired_at)
+        self.assertEqual(['user1'], self.reactivate.call_args[0][1])
@@ -0,0 +1,128 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+
+"""Index usage of the filter modes, checked with ``EXPLAIN``.
+
+SQLite and MySQL plans are both understood. Case insensitive and prefix
+matches only use an index with MySQL's case insensitive collations.
+"""
+
+import re
+import unittest
+
+from django.db import connection
+from django.test import TestCase
+
+from garr_horizon.content.garr_users.models import User
+from garr_horizon.content.garr_users.tests import helpers
+
+
+def explain(queryset):
+    """Plan of ``queryset``, one entry per step.
+
+    Entries are the detail strings of SQLite's ``EXPLAIN QUERY PLAN`` and
+    the rows, as dicts, of MySQL's ``EXPLAIN``.
+    """
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+        cursor.execute('EXPLAIN ' + sql, params)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def uses_index(plan, table):
+    """Whether ``table`` is read through an index seek or range scan."""
+    if connection.vendor == 'sqlite':
+        pattern = r'SEARCH (TABLE )?%s( AS \w+)? USING ' \
+                  r'(COVERING |INTEGER PRIMARY KEY|INDEX|PRIMARY KEY)' % table
+        return any(re.match(pattern, step) for step in plan)
+    return any(step['table'] == table and step['key'] is not None and
+               step['type'] != 'index' for step in plan)
+
+
+def scans(plan, table):
+    """Whether every row of ``table`` is read."""
+    if connection.vendor == 'sqlite':
+        pattern = r'SCAN (TABLE )?%s\b' % table
+        return any(re.match(pattern, step) for step in plan)
+    return any(step['table'] == table and step['type'] in ('ALL', 'index')
+               for step in plan)
+
+
+@unittest.skipUnless(connection.vendor in ('sqlite', 'mysql'),
+                     'EXPLAIN is only understood on SQLite and MySQL')
+class FilterIndexTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        projects = helpers.create_projects(20)
+        helpers.create_users(1000, projects=projects)
+        # Rare values, so that the optimizer picks the indexes of the low
+        # cardinality columns.
+        helpers.create_users(5, start=2000, idp='rare-idp',
+                             source='rare-source', duration=7)
+
+    def plan(self, field, filter_string):
+        return explain(User.objects.listing().filter_by(field, filter_string))
+
+    def assertIndexed(self, field, filter_string):
+        plan = self.plan(field, filter_string)
+        self.assertTrue(uses_index(plan, 'user'), plan)
+        self.assertFalse(scans(plan, 'user'), plan)
+
+    def test_exact(self):
+        self.assertIndexed('name', 'user42')
+        self.assertIndexed('cn', 'User 42')
+        self.assertIndexed('idp', 'rare-idp')
+        self.assertIndexed('source', 'rare-source')
+
+    def test_numeric(self):
+        self.assertIndexed('id', '42')
+        self.assertIndexed('duration', '7')
+
+    def test_project(self):
+        # The project is found through its unique name index, its users
+        # through the project foreign key index.
+        plan = self.plan('project', 'project7')
+        self.assertTrue(uses_index(plan, 'project'), plan)
+        self.assertTrue(uses_index(plan, 'user'), plan)
+        self.assertFalse(scans(plan, 'user'), plan)
+
+    @unittest.skipUnless(connection.vendor == 'mysql',
+                         'Needs a case insensitive collation')
+    def test_iexact(self):
+        self.assertIndexed('name', '~USER42')
+
+    @unittest.skipUnless(connection.vendor == 'mysql',
+                         'Needs a case insensitive collation')
+    def test_prefix(self):
+        self.assertIndexed('name', 'user42*')
+
+    def test_contains(self):
+        plan = self.plan('name', '*ser42*')
+        self.assertTrue(scans(plan, 'user'), plan)
+
+    def test_filters_match(self):
+        def names(field, filter_string):
+            return sorted(User.objects.filter_by(field, filter_string)
+                          .values_list('name', flat=True))
+        self.assertEqual(names('name', 'user42'), ['user42'])
+        self.assertEqual(names('name', '~USER42'), ['user42'])
+        self.assertEqual(len(names('name', 'user42*')), 11)
+        self.assertEqual(len(names('name', '*ser99*')), 11)
+        self.assertEqual(len(names('project', 'project7')), 50)
+        self.assertEqual(names('project', 'unknown'), [])
+        self.assertEqual(names('id', 'abc'), [])
@@ -0,0 +1,181 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+
+import io
+import itertools
+
+from django.contrib.auth.hashers import check_password
+from django.test import TestCase
+
+from garr_horizon.content.garr_users import importer
+from garr_horizon.content.garr_users.models import User
+from garr_horizon.content.garr_users.tests import helpers
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+HEADER = u'name,email,password,idp,project,cn,source,duration\n'
+
+
+def csv_file(*lines):
+    return io.StringIO(HEADER + u''.join(line + u'\n' for line in lines),
+                       newline='')
+
+
+class ImporterTest(TestCase):
+
+    def setUp(self):
+        helpers.create_projects(2)
+        # The test tables don't assign ids, unlike the production ones
+        ids = itertools.count(1000)
+        bulk_create = User.objects.bulk_create
+
+        def assign_ids(users, *args, **kwargs):
+            for user in users:
+                if user.id is None:
+                    user.id = next(ids)
+            return bulk_create(users, *args, **kwargs)
+
+        patcher = mock.patch.object(User.objects, 'bulk_create', assign_ids)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def import_users(self, stream, file_format='csv', chunk_size=1000):
+        return importer.import_users(stream, file_format, chunk_size,
+                                     processes=0)
+
+    def test_csv(self):
+        report = self.import_users(csv_file(
+            u'alice,alice@example.org,secret1,idp,project1,Alice,src,30',
+            u'bob,bob@example.org,secret2,idp,,,,',
+            u'j\xf6rg,jorg@example.org,secret3,idp,project2,J\xf6rg,,'))
+        self.assertEqual(report.created, 3)
+        self.assertEqual(report.errors, [])
+        alice = User.objects.get(name='alice')
+        self.assertEqual(alice.project_id, 1)
+        self.assertEqual(alice.duration, 30)
+        self.assertEqual(alice.cn, 'Alice')
+        self.assertIsNotNone(alice.expires)
+        self.assertTrue(check_password('secret1', alice.password))
+        bob = User.objects.get(name='bob')
+        self.assertIsNone(bob.project_id)
+        self.assertIsNone(bob.cn)
+        self.assertIsNone(bob.expires)
+        self.assertEqual(User.objects.get(name=u'j\xf6rg').cn, u'J\xf6rg')
+
+    def test_json(self):
+        users = (u'[{"name": "alice", "email": "alice@example.org", '
+                 u'"password": "secret", "idp": "idp", '
+                 u'"project": "project1", "duration": 30},\n'
+                 u' {"name": "bob", "email": "bob@example.org", '
+                 u'"password": "secret", "idp": "idp"}]\n')
+        report = self.import_users(io.StringIO(users), 'json')
+        self.assertEqual(report.created, 2)
+        self.assertEqual(report.errors, [])
+
+    def test_json_lines(self):
+        users = (u'{"name": "alice", "email": "alice@example.org", '
+                 u'"password": "secret", "idp": "idp"}\n'
+                 u'{"name": "bob", "email": "bob@example.org", '
+                 u'"password": "secret", "idp": "idp"}\n')
+        report = self.import_users(io.StringIO(users), 'json')
+        self.assertEqual(report.created, 2)
+
+    def test_chunks(self):
+        report = self.import_users(csv_file(*[
+            u'user%d,user%d@example.org,secret,idp,,,,' % (i, i)
+            for i in range(7)]), chunk_size=3)
+        self.assertEqual(report.created, 7)
+        self.assertEqual(User.objects.count(), 7)
+
+    def test_invalid_rows(self):
+        report = self.import_users(csv_file(
+            u'alice,not-an-email,secret,idp,,,,',
+            u',bob@example.org,secret,idp,,,,',
+            u'carol,carol@example.org,secret,idp,unknown,,,',
+            u'dave,dave@example.org,secret,idp,,,,abc',
+            u'erin,erin@example.org,secret,idp,,,,'))
+        self.assertEqual(report.created, 1)
+        self.assertEqual([line for line, error in report.errors],
+                         [2, 3, 4, 5])
+        self.assertIn('email', report.errors[0][1])
+        self.assertIn('name', report.errors[1][1])
+        self.assertIn('Unknown project "unknown"', report.errors[2][1])
+        self.assertIn('duration', report.errors[3][1])
+        self.assertEqual(list(User.objects.values_list('name', flat=True)),
+                         ['erin'])
+
+    def test_unparsable_csv_line(self):
+        report = self.import_users(csv_file(
+            u'alice,alice@example.org,secret,idp,,,,',
+            u'bob,bob@example.org,secret,idp,,"%s",,' % (u'x' * 200000),
+            u'carol,carol@example.org,secret,idp,,,,'))
+        self.assertEqual(report.created, 2)
+        self.assertEqual(len(report.errors), 1)
+        line, error = report.errors[0]
+        self.assertEqual(line, 3)
+        self.assertIn('Unable to parse', error)
+
+    def test_malformed_json(self):
+        users = (u'[{"name": "alice", "email": "alice@example.org", '
+                 u'"password": "secret", "idp": "idp"},\n'
+                 u' 42,\n'
+                 u' {"name": "bob", "email": },\n'
+                 u' {"name": "carol", "email": "carol@example.org", '
+                 u'"password": "secret", "idp": "idp"}]\n')
+        report = self.import_users(io.StringIO(users), 'json')
+        self.assertEqual(report.created, 2)
+        self.assertEqual([line for line, error in report.errors], [2, 3])
+        self.assertEqual(report.errors[0][1], 'Not an object.')
+        self.assertIn('Unable to parse', report.errors[1][1])
+
+    def test_malformed_json_is_not_buffered(self):
+        # An unterminated item doesn't make the reader keep the rest of
+        # the file in memory.
+        users = (u'{"name": "' + u'x' * 5000 + u'\n' +
+                 u'{"name": "bob"}\n' * 1000)
+        rows = list(importer.read_json(io.StringIO(users), chunk_size=100,
+                                       max_item_size=1000))
+        self.assertIsInstance(rows[0][1], importer.ParseError)
+        self.assertEqual(len(rows), 1001)
+        self.assertEqual(rows[-1], (1001, {'name': 'bob'}))
+
+    def test_duplicates_in_file(self):
+        report = self.import_users(csv_file(
+            u'alice,alice@example.org,secret,idp,,,,',
+            u'alice,alice2@example.org,secret,idp,,,,',
+            u'bob,bob@example.org,secret,idp,,,,'), chunk_size=1)
+        self.assertEqual(report.created, 2)
+        self.assertEqual(report.errors,
+                         [(3, 'Duplicate of the user of line 2.')])
+        self.assertEqual(User.objects.filter(name='alice').count(), 1)
+
+    def test_duplicates_of_existing_users(self):
+        helpers.create_users(1, name='alice')
+        report = self.import_users(csv_file(
+            u'alice,alice@example.org,secret,idp,,,,',
+            u'bob,bob@example.org,secret,idp,,,,'))
+        self.assertEqual(report.created, 1)
+        self.assertEqual(report.errors,
+                         [(2, 'User "alice" already exists.')])
+        self.assertEqual(User.objects.filter(name='alice').count(), 1)
+
+    def test_count_rows(self):
+        stream = csv_file(
+            u'alice,alice@example.org,secret,idp,,,,',
+            u'bob,bob@example.org,secret,idp,,"%s",,' % (u'x' * 200000),
+            u'carol,carol@example.org,secret,idp,,,,')
+        self.assertEqual(importer.count_rows(stream), 3)
+        self.assertEqual(User.objects.count(), 0)
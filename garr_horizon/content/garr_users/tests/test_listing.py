@@ -0,0 +1,89 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+
+from datetime import datetime
+from datetime import timedelta
+import json
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from garr_horizon.content.garr_users import tables
+from garr_horizon.content.garr_users import views
+from garr_horizon.content.garr_users.models import User
+from garr_horizon.content.garr_users.tests import helpers
+from garr_horizon.content.garr_users.tests.test_views import ViewTestCase
+
+
+class ListingQueriesTest(TestCase):
+    """The users of a page are loaded with their project in one query."""
+
+    @classmethod
+    def setUpTestData(cls):
+        projects = helpers.create_projects(5)
+        helpers.create_users(60, projects=projects)
+
+    def render_page(self, limit, marker=None):
+        users, has_more = User.objects.listing().seek(marker=marker,
+                                                      limit=limit)
+        return [tables.get_project_name(user) for user in users]
+
+    def test_page_queries_dont_depend_on_rows(self):
+        for limit in (1, 10, 50):
+            with self.assertNumQueries(1):
+                names = self.render_page(limit)
+            self.assertEqual(len(names), limit)
+            self.assertNotIn('-', names)
+
+    def test_next_page_queries_dont_depend_on_rows(self):
+        for limit in (1, 10, 50):
+            with self.assertNumQueries(1):
+                names = self.render_page(limit, marker=5)
+            self.assertEqual(len(names), limit)
+
+    def test_users_without_project(self):
+        helpers.create_users(3, start=100)
+        with self.assertNumQueries(1):
+            users = list(User.objects.listing().filter(id__gte=100))
+            names = [tables.get_project_name(user) for user in users]
+        self.assertEqual(names, ['-'] * 3)
+
+
+class ViewQueriesTest(ViewTestCase):
+    """The refreshed rows and the detail page don't query per user."""
+
+    def get_rows(self, count):
+        since = datetime.now() - timedelta(minutes=1)
+        request = helpers.make_request(
+            ids=','.join(str(i) for i in range(1, count + 1)),
+            since=since.isoformat())
+        response = views.RowsView.as_view()(request)
+        self.assertEqual(200, response.status_code)
+        return json.loads(response.content.decode('utf-8'))['rows']
+
+    def test_refreshed_rows_queries_dont_depend_on_rows(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(len(self.get_rows(1)), 1)
+        for count in (10, 50):
+            with self.assertNumQueries(len(queries)):
+                rows = self.get_rows(count)
+            self.assertEqual(len(rows), count)
+
+    def test_detail_query(self):
+        view = views.DetailView()
+        view.request = helpers.make_request()
+        view.kwargs = {'user_id': '1'}
+        with self.assertNumQueries(1):
+            user = view.get_data()
+            self.assertEqual(user.project.name, 'project1')
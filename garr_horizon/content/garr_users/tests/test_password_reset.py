@@ -0,0 +1,100 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+
+import csv
+import io
+
+from django.contrib.auth.hashers import check_password
+from django.core.cache import cache
+from django.test import TestCase
+import six
+
+from garr_horizon.content.garr_users import credentials
+from garr_horizon.content.garr_users import hashing
+from garr_horizon.content.garr_users import jobs
+from garr_horizon.content.garr_users.models import PasswordResetJob
+from garr_horizon.content.garr_users.models import User
+from garr_horizon.content.garr_users.tests import helpers
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+def read_credentials(content):
+    if six.PY2:
+        content = content.decode('utf-8')
+    return list(csv.reader(io.StringIO(content)))
+
+
+class PasswordResetTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        helpers.create_users(5)
+        self.worker = jobs.PasswordResetWorker(hashing.HashingService(0))
+
+    def test_reset(self):
+        job = jobs.enqueue_password_reset('admin', [2, 4], 16)
+        # Nothing is reset during the request
+        self.assertIsNone(credentials.pop('admin', job.token))
+
+        self.assertEqual(1, self.worker.run())
+        job.refresh_from_db()
+        self.assertEqual(PasswordResetJob.DONE, job.status)
+        self.assertEqual(2, job.count)
+
+        rows = read_credentials(credentials.pop('admin', job.token))
+        self.assertEqual(list(credentials.HEADER), rows[0])
+        self.assertEqual(['2', '4'], [row[0] for row in rows[1:]])
+        for user_id, name, email, password in rows[1:]:
+            self.assertEqual(16, len(password))
+            self.assertTrue(check_password(
+                password, User.objects.get(id=user_id).password))
+        # The other users keep their passwords
+        self.assertEqual({None}, set(User.objects
+                                     .exclude(id__in=[2, 4])
+                                     .values_list('password', flat=True)))
+
+    def test_downloaded_once(self):
+        token = credentials.store('admin', [(1, u'user1', u'user1@example.org',
+                                             u'secret')])
+        self.assertIsNone(credentials.pop('other', token))
+        self.assertIsNotNone(credentials.pop('admin', token))
+        self.assertIsNone(credentials.pop('admin', token))
+
+    def test_failed_job_is_retried(self):
+        job = jobs.enqueue_password_reset('admin', [1], 16)
+        self.worker.max_attempts = 2
+        self.worker.hashing = None
+        self.assertEqual(1, self.worker.run_once())
+        job.refresh_from_db()
+        self.assertEqual(PasswordResetJob.PENDING, job.status)
+        self.assertEqual(1, self.worker.run_once())
+        job.refresh_from_db()
+        self.assertEqual(PasswordResetJob.FAILED, job.status)
+        self.assertTrue(job.error)
+        self.assertEqual(0, self.worker.run_once())
+
+    def test_failed_store_keeps_passwords(self):
+        User.objects.filter(id=1).update(password='old')
+        job = jobs.enqueue_password_reset('admin', [1], 16)
+        with mock.patch.object(credentials, 'store',
+                               side_effect=ValueError('Value too large')):
+            self.assertEqual(1, self.worker.run_once())
+        job.refresh_from_db()
+        self.assertEqual(PasswordResetJob.PENDING, job.status)
+        self.assertEqual('Value too large', job.error)
+        self.assertEqual('old', User.objects.get(id=1).password)
+        self.assertIsNone(credentials.pop('admin', job.token))
@@ -0,0 +1,84 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+
+import os
+import time
+import unittest
+
+from django.db import connection
+from django.test import TransactionTestCase
+
+from garr_horizon.content.garr_users.models import User
+from garr_horizon.content.garr_users.tests import helpers
+
+# Size of the latency fixture. The latency target is set for 500k users,
+# GARR_USERS_SEARCH_ROWS=500000 checks it at that size.
+FIXTURE_ROWS = int(os.environ.get('GARR_USERS_SEARCH_ROWS', 20000))
+
+# Slowest acceptable search, in seconds
+MAX_LATENCY = 0.1
+
+
+def search(query, marker=None, limit=20):
+    return User.objects.listing().filter_by('search', query) \
+        .seek(marker=marker, limit=limit, sort_key='-rank')
+
+
+# InnoDB only indexes committed rows, hence the transaction test case
+@unittest.skipUnless(connection.vendor in ('sqlite', 'mysql'),
+                     'No full-text index on this database')
+class SearchTest(TransactionTestCase):
+
+    def setUp(self):
+        helpers.create_users(FIXTURE_ROWS)
+        helpers.create_users(1, start=FIXTURE_ROWS + 1, name='zebra',
+                             email='zebra@example.org', cn='Zebra Stripes',
+                             source='zebra-source')
+        helpers.create_users(1, start=FIXTURE_ROWS + 2, name='horse',
+                             email='zebra.fan@example.org')
+        helpers.create_users(30, start=FIXTURE_ROWS + 10,
+                             source='pagination-source')
+
+    def test_ranked(self):
+        users, has_more = search('zebra')
+        self.assertEqual([user.name for user in users], ['zebra', 'horse'])
+        self.assertFalse(has_more)
+
+    def test_word_prefixes(self):
+        users, has_more = search('zeb strip')
+        self.assertEqual([user.name for user in users], ['zebra'])
+
+    def test_no_match(self):
+        self.assertEqual(search('unicorn')[0], [])
+        self.assertEqual(search('?!')[0], [])
+
+    def test_paginated(self):
+        first, has_more = search('pagination', limit=20)
+        self.assertTrue(has_more)
+        second, has_more = search('pagination', marker=first[-1].id,
+                                  limit=20)
+        self.assertFalse(has_more)
+        ids = [user.id for user in first + second]
+        self.assertEqual(len(ids), 30)
+        self.assertEqual(len(set(ids)), 30)
+
+    def test_latency(self):
+        for query in ('zebra', 'user1234', 'source3', 'example'):
+            timings = []
+            for run in range(5):
+                start = time.time()
+                search(query)
+                timings.append(time.time() - start)
+            self.assertLess(min(timings), MAX_LATENCY,
+                            'Searching "%s" among %d users took %.1f ms'
+                            % (query, FIXTURE_ROWS, min(timings) * 1000))
@@ -0,0 +1,53 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+
+from django.test import TestCase
+
+from garr_horizon.content.garr_users import keystone
+from garr_horizon.content.garr_users import policies
+from garr_horizon.content.garr_users import views
+from garr_horizon.content.garr_users.tests import helpers
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+class ViewTestCase(TestCase):
+    """Views run by an admin, without Keystone."""
+
+    @classmethod
+    def setUpTestData(cls):
+        projects = helpers.create_projects(5)
+        helpers.create_users(60, projects=projects)
+
+    def setUp(self):
+        for target, value in ((policies, 'check'),
+                              (policies, 'can_edit_user'),
+                              (keystone, 'match_users')):
+            patcher = mock.patch.object(target, value, return_value=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class IndexViewTest(ViewTestCase):
+
+    def test_row_update(self):
+        # Horizon's row updates preempt loading the table
+        request = helpers.make_request(ajax=True, table='users',
+                                       action='row_update', obj_id='1')
+        response = views.IndexView.as_view()(request)
+        self.assertEqual(200, response.status_code)
+        self.assertNotIn('ETag', response)
+        self.assertIn(b'user1', response.content)
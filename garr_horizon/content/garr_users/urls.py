@@ -27,6 +27,14 @@ urlpatterns = [
     url(r'^(?P<user_id>[^/]+)/update/$',
         views.UpdateView.as_view(), name='update'),
     url(r'^create/$', views.CreateView.as_view(), name='create'),
+    url(r'^bulk_update/$', views.BulkUpdateView.as_view(),
+        name='bulk_update'),
+    url(r'^reset_passwords/$', views.ResetPasswordsView.as_view(),
+        name='reset_passwords'),
+    url(r'^credentials/(?P<token>[0-9a-f]+)/$',
+        views.CredentialsView.as_view(), name='credentials'),
+    url(r'^import/$', views.ImportView.as_view(), name='import'),
+    url(r'^export/$', views.ExportView.as_view(), name='export'),
     url(r'^create-keystone-user/$', views.ActivateView.as_view(),
         name='create_keystone'),
     url(r'^(?P<user_id>[^/]+)/detail/$',
@@ -35,4 +43,11 @@ urlpatterns = [
         views.ChangePasswordView.as_view(), name='change_password'),
     url(r'^(?P<user_id>[^/]+)/activate/$',
         views.ActivateView.as_view(), name='activate'),
+    url(r'^rows/$', views.RowsView.as_view(), name='rows'),
+    url(r'^reconciliation/$', views.ReconciliationView.as_view(),
+        name='reconciliation'),
+    url(r'^projects/$', views.ProjectLookupView.as_view(), name='projects'),
+    url(r'^jobs/$', views.JobsView.as_view(), name='jobs'),
+    url(r'^jobs/(?P<job_id>[^/]+)/$',
+        views.JobDetailView.as_view(), name='job_detail'),
 ]
@@ -16,71 +16,472 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import csv
+from datetime import datetime
+from datetime import timedelta
+import hashlib
+import json
 import logging
 import operator
 
 from django.conf import settings
+from django import http
 from django.core.urlresolvers import reverse
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.urlresolvers import reverse_lazy
+from django.db.models import Case, Count, IntegerField, Max, Sum, When
+from django.utils.dateparse import parse_datetime
 from django.utils.decorators import method_decorator
+from django.utils.http import parse_etags
+from django.utils.http import quote_etag
+from django.utils import translation
 from django.utils.translation import ugettext_lazy as _
 from django.views.decorators.debug import sensitive_post_parameters
+from django.views import generic
 
 from horizon import exceptions
 from horizon import forms
 from horizon import messages
 from horizon import tables
 from horizon.utils import memoized
+from horizon.utils import functions as utils
 from horizon import views
 
-from openstack_dashboard import api
-from openstack_dashboard import policy
-
+from garr_horizon.content.garr_users import credentials
 from garr_horizon.content.garr_users import forms as project_forms
+from garr_horizon.content.garr_users import keystone
+from garr_horizon.content.garr_users import policies
+from garr_horizon.content.garr_users import reconcile
 from garr_horizon.content.garr_users import tables as project_tables
 from openstack_dashboard.utils import identity
+from garr_horizon.content.garr_users.models import PasswordResetJob
+from garr_horizon.content.garr_users.models import ProvisioningJob
+from garr_horizon.content.garr_users.models import ProvisioningTask
 from garr_horizon.content.garr_users.models import User, Project
 
 LOG = logging.getLogger(__name__)
 
-class IndexView(tables.DataTableView):
+def get_rows_since(now):
+    """``since`` of the next poll of the rows, for a poll made at ``now``.
+
+    The ``updated`` timestamps are set before their transaction commits,
+    a row can become visible after a poll while dated before it. The next
+    poll overlaps the previous one by GARR_USERS_ROWS_OVERLAP seconds (60
+    by default) to catch those rows, sending some rows twice.
+    """
+    return now - timedelta(
+        seconds=getattr(settings, 'GARR_USERS_ROWS_OVERLAP', 60))
+
+
+class PolicyCheckMixin(object):
+    """Answer 403 Forbidden to users failing the view's ``policy_rules``."""
+    policy_rules = ()
+
+    def dispatch(self, request, *args, **kwargs):
+        if self.policy_rules and \
+                not policies.check(self.policy_rules, request):
+            return http.HttpResponseForbidden()
+        return super(PolicyCheckMixin, self).dispatch(request, *args,
+                                                      **kwargs)
+
+
+class ConditionalGetMixin(object):
+    """Answer reloads of an unchanged page with 304 Not Modified.
+
+    The ETag of the page is built from ``get_validator``, which views
+    implement with a cheap query returning what the page depends on, and
+    from the user, project and language it is rendered for. Pages with
+    pending messages are always rendered, so the messages are shown.
+
+    Pages also depending on data that can't be validated up front, like
+    the Keystone accounts cached by each Horizon process, set
+    ``validate_after_loading`` and implement ``get_loaded_validator``.
+    Their ETag is only computed once their data is loaded, and a 304 then
+    only saves rendering the page. Responses of AJAX requests, like
+    Horizon's row updates, and pages whose data wasn't loaded (the loaded
+    validator is ``None``) are returned as they are.
+    """
+    validate_after_loading = False
+
+    def get_validator(self):
+        return None
+
+    def get_loaded_validator(self):
+        return None
+
+    def get_etag(self, validator):
+        user = self.request.user
+        parts = (validator, getattr(user, 'id', None),
+                 getattr(user, 'project_id', None),
+                 translation.get_language(),
+                 Project.objects.choices_version())
+        return hashlib.md5(repr(parts).encode('utf-8')).hexdigest()
+
+    def get(self, request, *args, **kwargs):
+        get = super(ConditionalGetMixin, self).get
+        if len(getattr(request, '_messages', ())):
+            return get(request, *args, **kwargs)
+        validator = self.get_validator()
+        if validator is None:
+            return get(request, *args, **kwargs)
+        if self.validate_after_loading:
+            # The data is loaded, the response isn't rendered yet
+            response = get(request, *args, **kwargs)
+            if response.status_code != 200 or request.is_ajax() or \
+                    len(getattr(request, '_messages', ())):
+                return response
+            loaded = self.get_loaded_validator()
+            if loaded is None:
+                return response
+            validator = (validator, loaded)
+        etag = self.get_etag(validator)
+        # Older Django versions strip the quotes of the parsed ETags
+        etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        if etag in etags or quote_etag(etag) in etags:
+            response = http.HttpResponseNotModified()
+        elif not self.validate_after_loading:
+            response = get(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        response['ETag'] = quote_etag(etag)
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+def get_keystone_state(user):
+    """The Keystone account of ``user`` as shown by the users table."""
+    keystone_user = getattr(user, 'keystone_user', None)
+    return (user.id, getattr(user, 'keystone_match', 'unknown'),
+            getattr(keystone_user, 'id', None),
+            getattr(keystone_user, 'name', None))
+
+
+class IndexView(ConditionalGetMixin, tables.DataTableView):
     table_class = project_tables.UsersTable
     template_name = 'identity/garr_users/index.html'
     page_title = _("External Users")
+    validate_after_loading = True
+
+    def __init__(self, *args, **kwargs):
+        super(IndexView, self).__init__(*args, **kwargs)
+        self._prev = False
+        self._more = False
+        self._since = datetime.now()
+
+    def has_prev_data(self, table):
+        return self._prev
+
+    def has_more_data(self, table):
+        return self._more
+
+    def get_page_size(self):
+        return (getattr(settings, 'GARR_USERS_PAGE_SIZE', None) or
+                utils.get_page_size(self.request))
+
+    def get_sort_key(self, filters=None):
+        # Search results are sorted by relevance
+        if filters is not None and filters[0] == 'search':
+            return '-rank'
+        return getattr(settings, 'GARR_USERS_SORT_KEY', 'id')
+
+    def get_markers(self):
+        meta = self.table_class._meta
+        markers = []
+        for param in (meta.pagination_param, meta.prev_pagination_param):
+            try:
+                markers.append(int(self.request.GET[param]))
+            except (KeyError, ValueError):
+                markers.append(None)
+        return markers
 
     def get_filters(self):
         filter_field = self.table.get_filter_field()
         filter_string = self.table.get_filter_string()
         if filter_string:
-            if filter_field == 'project':
-                filter_string = Project.objects.get(name=filter_string).id
-            return {filter_field: filter_string}
+            return filter_field, filter_string
         else:
             return None
 
     def get_data(self):
         users = []
         list_permission = False
-        if policy.check((("identity", "identity:list_users"),),
-                        self.request):
-            list_permission = True
-        elif policy.check((("identity", "identity:get_user"),),
+        if policies.check((("identity", "identity:list_users"),),
                           self.request):
             list_permission = True
+        elif policies.check((("identity", "identity:get_user"),),
+                            self.request):
+            list_permission = True
 
         if list_permission:
+            # Rows updated from now on are refreshed by RowsView
+            self._since = datetime.now()
+            marker, prev_marker = self.get_markers()
             filters = self.get_filters()
             try:
+                queryset = User.objects.listing()
                 if filters is not None:
-                    return User.objects.filter(**filters)
+                    queryset = queryset.filter_by(*filters)
+                users, has_more = queryset.seek(
+                    marker=prev_marker if prev_marker is not None else marker,
+                    limit=self.get_page_size(),
+                    sort_key=self.get_sort_key(filters),
+                    reverse=prev_marker is not None)
+                keystone.match_users(self.request, users)
+                if prev_marker is not None:
+                    self._prev = has_more
+                    self._more = True
                 else:
-                    return User.objects.all()
+                    self._prev = marker is not None
+                    self._more = has_more
             except Exception:
                 exceptions.handle(self.request,
                                     _('Unable to retrieve user list.'))
         else:
             msg = _("Insufficient privilege level to view user information.")
             messages.info(self.request, msg)
+        return users
+
+    def get_context_data(self, **kwargs):
+        context = super(IndexView, self).get_context_data(**kwargs)
+        context['rows_since'] = get_rows_since(self._since).isoformat()
+        return context
+
+    def get_validator(self):
+        """Last update, count and highest id of the filtered users.
+
+        Along with the filter and the page parameters, they change
+        whenever a user of the page is created, updated or deleted.
+        """
+        table = self.table_class(self.request)
+        filters = (table.get_filter_field(), table.get_filter_string())
+        users = User.objects.all()
+        if filters[1]:
+            users = users.filter_by(*filters)
+        stats = users.order_by().aggregate(updated=Max('updated'),
+                                           count=Count('id'),
+                                           last=Max('id'))
+        # Expiring users change with time alone
+        clock = datetime.now().strftime('%Y%m%d%H%M') \
+            if filters[0] == 'expiring' else None
+        return (stats['updated'], stats['count'], stats['last'], filters,
+                sorted(self.request.GET.items()), self.get_page_size(),
+                clock)
+
+    def get_loaded_validator(self):
+        """The Keystone accounts of the users of the page.
+
+        ``None`` when the table wasn't loaded, the response of a row
+        update preempts loading it.
+        """
+        table = getattr(self, 'table', None)
+        if table is None or table.data is None:
+            return None
+        return [get_keystone_state(user) for user in table.data]
+
+
+class RowsView(PolicyCheckMixin, generic.View):
+    """Render the users table rows updated since the client's last poll.
+
+    The rows of the ``ids`` parameter are fetched with one query, with
+    their project joined, and only the ones whose ``updated`` timestamp
+    is not older than the ``since`` parameter are rendered. The response
+    holds the rendered rows by id and the ``since`` of the next poll, see
+    ``get_rows_since``.
+    """
+    limit = 500
+    policy_rules = (("identity", "identity:list_users"),)
+
+    def get(self, request, *args, **kwargs):
+        try:
+            ids = [int(user_id) for user_id
+                   in request.GET.get('ids', '').split(',') if user_id]
+        except ValueError:
+            return http.HttpResponseBadRequest()
+        since = parse_datetime(request.GET.get('since', ''))
+        if since is None or len(ids) > self.limit:
+            return http.HttpResponseBadRequest()
+
+        now = datetime.now()
+        users = list(User.objects.listing()
+                     .filter(id__in=ids, updated__gte=since))
+        keystone.match_users(request, users)
+        table = project_tables.UsersTable(request, data=users)
+        rows = dict((str(row.datum.id), row.render())
+                    for row in table.get_rows())
+        return http.JsonResponse({'rows': rows,
+                                  'since': get_rows_since(now).isoformat()})
+
+
+class ProjectLookupView(generic.View):
+    """JSON list of the projects whose name starts with the ``q`` parameter.
+
+    Projects are sorted by name and paginated on it, pass the last
+    returned name as ``marker`` to get the next page. Both the prefix
+    match and the pagination use the unique index on the project name.
+    """
+    limit = 20
+
+    def get(self, request, *args, **kwargs):
+        projects = Project.objects.order_by('name')
+        query = request.GET.get('q')
+        if query:
+            projects = projects.filter(name__istartswith=query)
+        marker = request.GET.get('marker')
+        if marker:
+            projects = projects.filter(name__gt=marker)
+        projects = list(projects.values('id', 'name')[:self.limit + 1])
+        return http.JsonResponse({'projects': projects[:self.limit],
+                                  'has_more': len(projects) > self.limit})
+
+
+class Echo(object):
+    """File-like object handing back what is written to it."""
+
+    def write(self, value):
+        return value
+
+
+class ExportView(generic.View):
+    """Stream the users matching the table filter as CSV or JSON.
+
+    Users are fetched ``chunk_size`` rows at a time, with the name of
+    their project joined in, and written out as they come, so memory
+    use doesn't depend on the number of users.
+    """
+    fields = ('id', 'name', 'email', 'idp', 'cn', 'source', 'duration',
+              'project')
+    chunk_size = 1000
+
+    def get(self, request, *args, **kwargs):
+        if not policies.check((("identity", "identity:list_users"),),
+                              request):
+            return http.HttpResponseForbidden()
+        file_format = request.GET.get('format', 'csv')
+        if file_format not in ('csv', 'json'):
+            return http.HttpResponseBadRequest()
+
+        users = User.objects.listing()
+        table = project_tables.UsersTable(request)
+        if table.get_filter_string():
+            users = users.filter_by(table.get_filter_field(),
+                                    table.get_filter_string())
+        rows = (self.get_row(user)
+                for user in users.chunked(self.chunk_size))
+
+        if file_format == 'csv':
+            content, content_type = self.write_csv(rows), 'text/csv'
+        else:
+            content, content_type = self.write_json(rows), 'application/json'
+        response = http.StreamingHttpResponse(content,
+                                              content_type=content_type)
+        response['Content-Disposition'] = \
+            'attachment; filename="garr_users.%s"' % file_format
+        return response
+
+    def get_row(self, user):
+        return (user.id, user.name, user.email, user.idp, user.cn,
+                user.source, user.duration,
+                user.project.name if user.project_id else None)
+
+    def write_csv(self, rows):
+        writer = csv.writer(Echo())
+        yield writer.writerow(self.fields)
+        for row in rows:
+            yield writer.writerow(credentials.encode_row(row))
+
+    def write_json(self, rows):
+        yield '['
+        separator = ''
+        for row in rows:
+            yield separator + json.dumps(dict(zip(self.fields, row)),
+                                         cls=DjangoJSONEncoder)
+            separator = ',\n'
+        yield ']\n'
+
+
+def count_tasks(status):
+    return Sum(Case(When(tasks__status=status, then=1), default=0,
+                    output_field=IntegerField()))
+
+
+class JobsView(PolicyCheckMixin, tables.DataTableView):
+    table_class = project_tables.ProvisioningJobsTable
+    template_name = 'identity/garr_users/jobs.html'
+    page_title = _("Keystone Jobs")
+    policy_rules = (("identity", "identity:create_user"),)
+    limit = 50
+
+    def get_data(self):
+        try:
+            jobs = ProvisioningJob.objects \
+                .annotate(total=Count('tasks'),
+                          done=count_tasks(ProvisioningTask.DONE),
+                          failed=count_tasks(ProvisioningTask.FAILED)) \
+                .order_by('-id')
+            return list(jobs[:self.limit])
+        except Exception:
+            exceptions.handle(self.request,
+                              _('Unable to retrieve Keystone jobs.'))
+            return []
+
+
+class JobDetailView(PolicyCheckMixin, views.HorizonTemplateView):
+    template_name = 'identity/garr_users/job_detail.html'
+    page_title = "{{ job.id }}"
+    policy_rules = (("identity", "identity:create_user"),)
+    failures_limit = 100
+
+    def get_context_data(self, **kwargs):
+        context = super(JobDetailView, self).get_context_data(**kwargs)
+        try:
+            job = ProvisioningJob.objects.get(id=self.kwargs['job_id'])
+            counts = dict(job.tasks.order_by()
+                          .values_list('status')
+                          .annotate(count=Count('id')))
+            failures = job.tasks.filter(status=ProvisioningTask.FAILED) \
+                .select_related('user') \
+                .order_by('id')[:self.failures_limit]
+        except Exception:
+            redirect = reverse('horizon:identity:garr_users:jobs')
+            exceptions.handle(self.request,
+                              _('Unable to retrieve job details.'),
+                              redirect=redirect)
+        context['job'] = job
+        context['counts'] = [(label, counts.get(status, 0)) for status, label
+                             in ProvisioningTask.STATUS_CHOICES]
+        context['failures'] = failures
+        return context
+
+
+class ReconciliationView(PolicyCheckMixin, views.HorizonTemplateView):
+    """Last report of the garr_users_reconcile management command."""
+    template_name = 'identity/garr_users/reconciliation.html'
+    page_title = _("Keystone Reconciliation")
+    policy_rules = (("identity", "identity:list_users"),)
+
+    def get_context_data(self, **kwargs):
+        context = super(ReconciliationView, self).get_context_data(**kwargs)
+        report = reconcile.last_report()
+        context['report'] = report
+        if report is not None:
+            context['api_calls'] = sorted(report.api_calls.items())
+            context['sections'] = [
+                (_('GARR users without a Keystone account'),
+                 [name for user_id, name in report.missing],
+                 report.missing_count),
+                (_('Keystone users without a GARR user'),
+                 report.orphaned, report.orphaned_count),
+                (_('GARR projects missing from Keystone'),
+                 report.unknown_projects, report.unknown_projects_count),
+                (_('GARR users missing their default role'),
+                 [name for user_id, name in report.missing_roles],
+                 report.missing_roles_count),
+                (_('Failed fixes'),
+                 ['%s: %s' % error for error in report.fix_errors],
+                 report.fix_errors_count),
+            ]
+        return context
+
 
 class UpdateView(forms.ModalFormView):
     template_name = 'identity/garr_users/update.html'
@@ -97,7 +498,8 @@ class UpdateView(forms.ModalFormView):
     @memoized.memoized_method
     def get_object(self):
         try:
-            return User.objects.get(id=self.kwargs['user_id'])
+            return User.objects.defer('password') \
+                .get(id=self.kwargs['user_id'])
         except Exception:
             redirect = reverse("horizon:identity:garr_users:index")
             exceptions.handle(self.request,
@@ -112,18 +514,96 @@ class UpdateView(forms.ModalFormView):
 
     def get_initial(self):
         user = self.get_object()
+        # Compared with the submitted text, to tell whether it changed
+        project = '' if user.project_id is None else str(user.project_id)
         data = {'id': user.id,
                 'name': user.name,
-                'project': user.project,
+                'project': project,
                 'email': getattr(user, 'email'),
                 'idp': getattr(user, 'idp'),
                 'cn': getattr(user, 'cn', ''),
                 'source': getattr(user, 'source', ''),
                 'duration': getattr(user, 'duration', ''),
+                'version': user.updated.isoformat(),
                }
         return data
 
 
+class BulkUpdateView(forms.ModalFormView):
+    template_name = 'identity/garr_users/bulk_update.html'
+    form_id = "bulk_update_users_form"
+    form_class = project_forms.BulkUpdateUserForm
+    submit_label = _("Update Users")
+    submit_url = reverse_lazy("horizon:identity:garr_users:bulk_update")
+    success_url = reverse_lazy('horizon:identity:garr_users:index')
+    page_title = _("Update Users")
+
+    def get_initial(self):
+        ids = self.request.GET.get('ids')
+        if ids:
+            return {'ids': ids}
+        # Without a selection, update the users matching the table filter
+        table = project_tables.UsersTable(self.request)
+        return {'filter_field': table.get_filter_field(),
+                'filter_string': table.get_filter_string()}
+
+    def get_context_data(self, **kwargs):
+        context = super(BulkUpdateView, self).get_context_data(**kwargs)
+        form = context['form']
+        data = form.data if form.is_bound else form.initial
+        if data.get('ids'):
+            context['count'] = len(data['ids'].split(','))
+        elif not data.get('filter_string'):
+            context['count'] = 0
+        else:
+            context['count'] = self.form_class.get_users({
+                'ids': None,
+                'filter_field': data.get('filter_field'),
+                'filter_string': data.get('filter_string')}).count()
+        return context
+
+
+class ResetPasswordsView(BulkUpdateView):
+    template_name = 'identity/garr_users/reset_passwords.html'
+    form_id = "reset_passwords_form"
+    form_class = project_forms.ResetPasswordsForm
+    submit_label = _("Reset Passwords")
+    submit_url = reverse_lazy("horizon:identity:garr_users:reset_passwords")
+    page_title = _("Reset Passwords")
+
+    @method_decorator(sensitive_post_parameters('password',
+                                                'confirm_password'))
+    def dispatch(self, *args, **kwargs):
+        return super(ResetPasswordsView, self).dispatch(*args, **kwargs)
+
+
+class CredentialsView(generic.View):
+    """Download, once, the credentials generated by a password reset."""
+
+    def get(self, request, token, *args, **kwargs):
+        job = PasswordResetJob.objects \
+            .filter(owner=request.user.username, token=token).first()
+        if job is None:
+            raise http.Http404()
+        if job.status == PasswordResetJob.FAILED:
+            messages.error(request, _('Unable to reset the passwords.'))
+            return http.HttpResponseRedirect(
+                reverse('horizon:identity:garr_users:index'))
+        if job.status != PasswordResetJob.DONE:
+            messages.info(request, _('The passwords are still being reset, '
+                                     'try again in a moment.'))
+            return http.HttpResponseRedirect(
+                reverse('horizon:identity:garr_users:index'))
+        content = credentials.pop(request.user.username, token)
+        if content is None:
+            raise http.Http404()
+        response = http.HttpResponse(content, content_type='text/csv')
+        response['Content-Disposition'] = \
+            'attachment; filename="garr_credentials.csv"'
+        response['Cache-Control'] = 'no-store'
+        return response
+
+
 class CreateView(forms.ModalFormView):
     template_name = 'identity/garr_users/create.html'
     form_id = "create_user_form"
@@ -144,13 +624,25 @@ class CreateView(forms.ModalFormView):
 
 
 
-class DetailView(views.HorizonTemplateView):
+class ImportView(forms.ModalFormView):
+    template_name = 'identity/garr_users/import.html'
+    form_id = "import_users_form"
+    form_class = project_forms.ImportUsersForm
+    submit_label = _("Import")
+    submit_url = reverse_lazy("horizon:identity:garr_users:import")
+    success_url = reverse_lazy('horizon:identity:garr_users:index')
+    page_title = _("Import Users")
+
+
+class DetailView(ConditionalGetMixin, views.HorizonTemplateView):
     template_name = 'identity/garr_users/detail.html'
     page_title = "{{ user.name }}"
+    validate_after_loading = True
 
     def get_context_data(self, **kwargs):
         context = super(DetailView, self).get_context_data(**kwargs)
         user = self.get_data()
+        keystone.match_users(self.request, [user])
         table = project_tables.UsersTable(self.request)
         context["user"] = user
         context["url"] = self.get_redirect_url()
@@ -161,7 +653,8 @@ class DetailView(views.HorizonTemplateView):
     def get_data(self):
         try:
             user_id = self.kwargs['user_id']
-            user = User.objects.get(id=user_id)
+            user = User.objects.select_related('project') \
+                .defer('password').get(id=user_id)
         except Exception:
             redirect = self.get_redirect_url()
             exceptions.handle(self.request,
@@ -169,6 +662,17 @@ class DetailView(views.HorizonTemplateView):
                               redirect=redirect)
         return user
 
+    def get_validator(self):
+        try:
+            user = User.objects.filter(id=self.kwargs['user_id']) \
+                .values_list('id', 'updated')[0]
+        except (IndexError, ValueError):
+            return None
+        return user
+
+    def get_loaded_validator(self):
+        return get_keystone_state(self.get_data())
+
     def get_redirect_url(self):
         return reverse('horizon:identity:garr_users:index')
 
@@ -190,7 +694,8 @@ class ChangePasswordView(forms.ModalFormView):
     @memoized.memoized_method
     def get_object(self):
         try:
-            return User.objects.get(id=self.kwargs['user_id'])
+            return User.objects.only('id', 'name') \
+                .get(id=self.kwargs['user_id'])
         except Exception:
             redirect = reverse("horizon:identity:garr_users:index")
             exceptions.handle(self.request,
@@ -222,33 +727,47 @@ class ActivateView(forms.ModalFormView):
     def dispatch(self, *args, **kwargs):
         return super(ActivateView, self).dispatch(*args, **kwargs)
 
-    @staticmethod
     @memoized.memoized_method
-    def get_object(user_id):
+    def get_object(self, user_id):
         try:
-            return User.objects.get(id=user_id)
+            return User.objects.select_related('project') \
+                .only('id', 'name', 'email', 'project__name').get(id=user_id)
         except Exception:
             redirect = reverse('horizon:identity:garr_users:index')
             exceptions.handle(self.request,
-                              _('Unable to retrieve user information.'))
+                              _('Unable to retrieve user information.'),
+                              redirect=redirect)
 
-    def get_form_kwargs(self):
-        kwargs = super(ActivateView, self).get_form_kwargs()
+    @memoized.memoized_method
+    def get_keystone_data(self):
+        """Fetch the Keystone data of the form, all lookups at once."""
+        request = self.request
         try:
-            roles = api.keystone.role_list(self.request)
+            return keystone.gather(
+                roles=lambda: keystone.role_list(request),
+                domain=lambda: keystone.get_default_domain(request),
+                default_role=lambda: keystone.get_default_role(request),
+                projects=lambda: keystone.tenant_list(request)[0])
         except Exception:
             redirect = reverse("horizon:identity:garr_users:index")
             exceptions.handle(self.request,
-                              _("Unable to retrieve user roles."),
+                              _("Unable to retrieve Keystone information."),
                               redirect=redirect)
+
+    def get_form_kwargs(self):
+        kwargs = super(ActivateView, self).get_form_kwargs()
+        data = self.get_keystone_data()
+        roles = data['roles']
         roles.sort(key=operator.attrgetter("id"))
         kwargs['roles'] = roles
+        kwargs['projects'] = data['projects']
         return kwargs
 
     def get_initial(self):
         # Set the domain of the user
-        domain = api.keystone.get_default_domain(self.request)
-        default_role = api.keystone.get_default_role(self.request)
+        data = self.get_keystone_data()
+        domain = data['domain']
+        default_role = data['default_role']
         user_id = self.kwargs.get('user_id', None)
         if not user_id:
             return  {
@@ -263,5 +782,6 @@ class ActivateView(forms.ModalFormView):
                     'role_id': getattr(default_role, "id", None),
                     'name': user.name,
                     'email': user.email,
+                    'project': user.project.name if user.project else None,
                     'default_user_id': int(user.id)}
 
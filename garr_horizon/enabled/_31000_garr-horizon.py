@@ -5,6 +5,9 @@ PANEL_DASHBOARD = 'identity'
 # The slug of the panel group the PANEL is associated with.
 PANEL_GROUP = 'default'
 # A list o applications to be prepended to INSTALLED_APPS
-ADD_INSTALLED_APPS = ['garr-horizon']
+ADD_INSTALLED_APPS = ['garr_horizon.content.garr_users']
 # Python panel class of the PANEL to be added.
 ADD_PANEL = 'garr_horizon.content.garr_users.panel.GarrUsers'
+# A list of javascript files to be included in all pages
+ADD_JS_FILES = ['garr_users/js/project_typeahead.js',
+                'garr_users/js/row_refresh.js']